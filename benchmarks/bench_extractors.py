@@ -0,0 +1,42 @@
+"""
+Compare product page extractors on the pages in benchmarks/fixtures.
+The fixtures are synthetic pages written after the markup of the shop, not saved live pages,
+and there are two of them, in stock and sold out: the equivalence check covers only these two
+
+    python -m benchmarks.bench_extractors [rounds]
+"""
+import sys
+import timeit
+from pathlib import Path
+
+from simply_parser.extractors import EXTRACTORS
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures'
+
+
+def run(rounds: int = 50) -> bool:
+    pages = {path.name: path.read_text(encoding='utf-8') for path in sorted(FIXTURES_DIR.glob('product_*.html'))}
+
+    for name, html in pages.items():
+        results = {extractor: extract(html, name, ['fixture']) for extractor, extract in EXTRACTORS.items()}
+        reference = results.pop('soup')
+        for extractor, result in results.items():
+            if result != reference:
+                print(f'{extractor} differs from soup on {name}:\n{result}\n{reference}')
+                return False
+
+    timings = {}
+    for extractor, extract in EXTRACTORS.items():
+        seconds = min(timeit.repeat(lambda: [extract(html, name, ['fixture']) for name, html in pages.items()],
+                                    number=rounds, repeat=3))
+        timings[extractor] = seconds / (rounds * len(pages)) * 1000
+        print(f'{extractor:>6}: {timings[extractor]:.2f} ms/page')
+
+    for extractor, ms in timings.items():
+        if extractor != 'soup':
+            print(f'{extractor} is {timings["soup"] / ms:.1f}x faster than soup')
+    return all(ms < timings['soup'] for extractor, ms in timings.items() if extractor != 'soup')
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run(*map(int, sys.argv[1:])) else 1)
@@ -0,0 +1,129 @@
+"""
+Run the crawl and the upload end to end against the local stand-ins of benchmarks/stand_ins.py
+
+    python -m benchmarks.bench_pipeline [--products 500] [--shop-latency 0.05] [--wc-latency 0.2]
+                                        [--engine threads]
+
+Stages: crawl, upload (delete all and create), sync (updates to add the content hashes),
+sync_dry_run (nothing left to change) and refresh (price and stock of every product again).
+Reports pages/sec, products/sec, p50/p99 request latency and peak RSS of each stage.
+Latency is measured on the requests sessions, the async engine reports none
+"""
+import argparse
+import json
+import resource
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+from benchmarks.stand_ins import ShopHandler, WooCommerceHandler, start_server
+from config import BASE_DIR, SimplyConfig, WoocommerceConfig
+from simply_parser import SimplyGreenTrade
+from upload_wc import WooCommerceDriver
+
+
+def record_latency(session: requests.Session, latencies: list) -> None:
+    session.hooks['response'].append(lambda response, *args, **kwargs:
+                                     latencies.append(response.elapsed.total_seconds()))
+
+
+def get_served(url: str) -> int:
+    return requests.get(f'{url}/__stats').json()['requests']
+
+
+def get_peak_rss() -> dict:
+    """
+    Peak resident set size in MiB of this process and of the largest finished child (parser processes)
+    """
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def iter_counted(items, counter: list):
+    for item in items:
+        counter[0] += 1
+        yield item
+
+
+def get_report(seconds: float, pages: int, products: int, latencies: list) -> dict:
+    report = {
+        'seconds': round(seconds, 3),
+        'pages': pages,
+        'products': products,
+        'pages_per_sec': round(pages / seconds, 1),
+        'products_per_sec': round(products / seconds, 1),
+    }
+    if len(latencies) >= 2:
+        percentiles = statistics.quantiles(latencies, n=100)
+        report['latency_p50_ms'] = round(percentiles[49] * 1000, 1)
+        report['latency_p99_ms'] = round(percentiles[98] * 1000, 1)
+    report['peak_rss_mb'] = {name: round(value, 1) for name, value in get_peak_rss().items()}
+    return report
+
+
+def run(products_count: int = 500, shop_latency: float = 0.05, wc_latency: float = 0.2,
+        engine: str = 'threads') -> dict:
+    shop, shop_url = start_server(ShopHandler, shop_latency, products_count)
+    store, store_url = start_server(WooCommerceHandler, wc_latency)
+    work_dir = Path(tempfile.mkdtemp(prefix='sgt-bench-'))
+    report = {}
+    try:
+        shop_latencies, store_latencies = [], []
+
+        start = time.perf_counter()
+        sgt = SimplyGreenTrade(BASE_DIR, SimplyConfig('bench', 'bench', simply_url=shop_url),
+                               cache=False, checkpoint_path=work_dir / 'checkpoint.sqlite')
+        record_latency(sgt.session, shop_latencies)
+        catalog = [category.split('/')[-2] for category in sgt.get_catalog_urls()]
+        sgt.parse_catalog(engine)
+        products = sgt.all_products
+        assert len({product.article for product in products}) == len(products), 'the stand-in shop repeats a sku'
+        report['crawl'] = get_report(time.perf_counter() - start, get_served(shop_url), len(products),
+                                     shop_latencies)
+
+        start = time.perf_counter()
+        wc_driver = WooCommerceDriver(WoocommerceConfig('bench', 'bench', store_url), cache_path=work_dir / 'wc')
+        record_latency(wc_driver.session, store_latencies)
+        wc_driver.create_category(catalog)
+        wc_driver.add_products(products)
+        served = get_served(store_url)
+        report['upload'] = get_report(time.perf_counter() - start, served, len(products), store_latencies)
+
+        for stage, dry_run in (('sync', False), ('sync_dry_run', True)):
+            store_latencies.clear()
+            start = time.perf_counter()
+            failed = wc_driver.sync_products(products, dry_run=dry_run)
+            report[stage] = get_report(time.perf_counter() - start, get_served(store_url) - served, len(products),
+                                       store_latencies)
+            report[stage]['failed'] = len(failed)
+            served = get_served(store_url)
+
+        shop_latencies.clear()
+        store_latencies.clear()
+        shop_served = get_served(shop_url)
+        start = time.perf_counter()
+        stocks_count = [0]
+        failed = wc_driver.refresh_stock(iter_counted(sgt.iter_stock(), stocks_count))
+        report['refresh'] = get_report(time.perf_counter() - start, get_served(shop_url) - shop_served,
+                                       stocks_count[0], shop_latencies + store_latencies)
+        report['refresh']['failed'] = len(failed)
+    finally:
+        shop.terminate()
+        store.terminate()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--shop-latency', type=float, default=0.05, help='seconds added to every shop response')
+    parser.add_argument('--wc-latency', type=float, default=0.2, help='seconds added to every WooCommerce response')
+    parser.add_argument('--engine', choices=('threads', 'async'), default='threads')
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.products, args.shop_latency, args.wc_latency, args.engine), indent=2))
@@ -0,0 +1,260 @@
+"""
+Local stand-ins for simplygreentrade.com and the WooCommerce REST API.
+Each server runs in its own process, so it does not share the GIL with the code under test.
+
+The shop is generated from the synthetic product pages in benchmarks/fixtures:
+paged catalogs, an infinite scroll catalog served by admin-ajax.php
+and one product page per article. GET /__stats returns the served request count
+"""
+import json
+import multiprocessing
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from config import SIMPLY_PARSER_ITEMS_PER_PAGE
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures'
+# article of every fixture, each product page gets a unique one instead
+FIXTURE_ARTICLES = {'product_available.html': 'RQS-AMH-F3', 'product_sold_out.html': 'GH-SLH-5'}
+PAGED_CATALOGS = ('seeds', 'accessories', 'nutrients', 'lighting')
+AJAX_CATALOG = 'new'
+AJAX_ITEMS_PER_PAGE = 25
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'StandInServer'
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def send_body(self, body: str | bytes, content_type: str = 'text/html; charset=UTF-8',
+                  status: int = 200, headers: dict = None) -> None:
+        body = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, headers: dict = None) -> None:
+        self.send_body(json.dumps(data), 'application/json; charset=UTF-8', headers=headers)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def dispatch(self, method: str) -> None:
+        parts = urlsplit(self.path)
+        if parts.path == '/__stats':
+            self.send_json({'requests': self.server.requests})
+            return
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency)
+        getattr(self, f'handle_{method}')(parts.path, parse_qs(parts.query))
+
+    def do_GET(self) -> None:
+        self.dispatch('get')
+
+    def do_POST(self) -> None:
+        self.dispatch('post')
+
+
+class ShopHandler(StandInHandler):
+    """
+    simplygreentrade.com with server.products_count products
+    """
+
+    def handle_get(self, path: str, query: dict) -> None:
+        base = self.server.url
+        if path == '/':
+            items = ''.join(f'<li class="item-level-0"><a href="{base}/product-category/{slug}/">{slug}</a></li>'
+                            for slug in PAGED_CATALOGS + (AJAX_CATALOG,))
+            # the last menu item is not a catalog
+            items += f'<li class="item-level-0"><a href="{base}/blog/">blog</a></li>'
+            self.send_body(f'<html><body><ul id="menu-desktop-horizontal-menu">{items}</ul></body></html>')
+        elif path == '/account/':
+            self.send_body('<html><body><form><input id="woocommerce-login-nonce" value="nonce"></form></body></html>')
+        elif match := re.fullmatch(r'/product-category/([\w-]+)/(?:page/(\d+)/?)?', path):
+            self.send_catalog(match[1], int(match[2] or 1))
+        elif match := re.fullmatch(r'/product/(\d+)/', path):
+            self.send_product(int(match[1]))
+        else:
+            self.send_body('not found', status=404)
+
+    def handle_post(self, path: str, query: dict) -> None:
+        body = parse_qs(self.read_body().decode('utf-8'))
+        if path == '/account/':
+            self.send_body('<html><body>logged in</body></html>')
+        elif path == '/wp-admin/admin-ajax.php':
+            page = int(body['paged'][0])
+            products = self.server.catalogs[AJAX_CATALOG]
+            products = products[(page - 1) * AJAX_ITEMS_PER_PAGE:page * AJAX_ITEMS_PER_PAGE]
+            if not products:
+                self.send_json({'status': 'no-more-posts'})
+                return
+            items = ''.join(f'<a class="product-image-link" href="{self.server.url}/product/{product}/"></a>'
+                            for product in products)
+            self.send_json({'status': 'have-posts', 'items': items})
+        else:
+            self.send_body('not found', status=404)
+
+    def send_catalog(self, slug: str, page: int) -> None:
+        products = self.server.catalogs.get(slug)
+        if products is None:
+            self.send_body('not found', status=404)
+            return
+        if slug == AJAX_CATALOG:
+            self.send_body('<html><body><div class="products"></div></body></html>')
+            return
+        page_products = products[(page - 1) * SIMPLY_PARSER_ITEMS_PER_PAGE:page * SIMPLY_PARSER_ITEMS_PER_PAGE]
+        items = ''.join(f'<div class="product-element-top"><a href="{self.server.url}/product/{product}/"></a></div>'
+                        for product in page_products)
+        self.send_body(f'<html><body><p class="woocommerce-result-count">Showing 1–24 of {len(products)} results'
+                       f'</p>{items}</body></html>')
+
+    def send_product(self, product: int) -> None:
+        if product >= self.server.products_count:
+            self.send_body('not found', status=404)
+            return
+        page, article = self.server.pages[product % len(self.server.pages)]
+        self.send_body(page.replace(article, f'SGT-{product:06d}'))
+
+
+class WooCommerceHandler(StandInHandler):
+    """
+    The part of the WooCommerce REST API v3 used by WooCommerceDriver, kept in memory
+    """
+
+    def handle_get(self, path: str, query: dict) -> None:
+        resource = self.get_resource(path)
+        if resource is None:
+            self.send_body('not found', status=404)
+            return
+        with self.server.lock:
+            items = list(resource.values())
+        per_page = int(query.get('per_page', ['10'])[0])
+        page = int(query.get('page', ['1'])[0])
+        total_pages = max((len(items) + per_page - 1) // per_page, 1)
+        self.send_json(items[(page - 1) * per_page:page * per_page],
+                       headers={'X-WP-Total': str(len(items)), 'X-WP-TotalPages': str(total_pages)})
+
+    def handle_post(self, path: str, query: dict) -> None:
+        resource = self.get_resource(path.removesuffix('/batch'))
+        if resource is None or not path.endswith('/batch'):
+            self.send_body('not found', status=404)
+            return
+        data = json.loads(self.read_body())
+        result = {}
+        with self.server.lock:
+            for action in ('create', 'update', 'delete'):
+                if action in data:
+                    result[action] = [getattr(self, f'batch_{action}')(resource, item) for item in data[action]]
+        self.send_json(result)
+
+    def get_resource(self, path: str) -> dict | None:
+        return {
+            '/wp-json/wc/v3/products': self.server.products,
+            '/wp-json/wc/v3/products/categories': self.server.categories,
+        }.get(path)
+
+    def next_id(self) -> int:
+        self.server.last_id += 1
+        return self.server.last_id
+
+    def set_images(self, item: dict) -> None:
+        images = []
+        for image in item.get('images', []):
+            if 'id' not in image:
+                image = {'id': self.next_id(), 'src': image['src']}
+            images.append(image)
+        item['images'] = images
+
+    def is_duplicate_sku(self, resource: dict, item: dict) -> bool:
+        """
+        WooCommerce rejects a sku that another product already has
+        """
+        return resource is self.server.products and bool(item.get('sku')) and any(
+            other.get('sku') == item['sku'] and other['id'] != item.get('id') for other in resource.values())
+
+    def batch_create(self, resource: dict, item: dict) -> dict:
+        if self.is_duplicate_sku(resource, item):
+            return {'id': 0, 'error': {'code': 'product_invalid_sku', 'message': 'Invalid or duplicated SKU.'}}
+        item = dict(item, id=self.next_id())
+        self.set_images(item)
+        resource[item['id']] = item
+        return item
+
+    def batch_update(self, resource: dict, item: dict) -> dict:
+        if item['id'] not in resource:
+            return {'id': item['id'], 'error': {'code': 'woocommerce_rest_product_invalid_id', 'message': 'Invalid ID.'}}
+        if self.is_duplicate_sku(resource, item):
+            return {'id': item['id'], 'error': {'code': 'product_invalid_sku', 'message': 'Invalid or duplicated SKU.'}}
+        current = resource[item['id']]
+        item = dict(item)
+        if 'meta_data' in item:
+            # WooCommerce merges meta by key, keys that are not sent are kept
+            meta_data = {meta['key']: meta for meta in current.get('meta_data', [])}
+            meta_data.update((meta['key'], meta) for meta in item.pop('meta_data'))
+            current['meta_data'] = list(meta_data.values())
+        current.update(item)
+        self.set_images(current)
+        return current
+
+    def batch_delete(self, resource: dict, item_id: int) -> dict:
+        item = resource.pop(item_id, None)
+        if item is None and resource is self.server.categories:
+            return {'id': item_id,
+                    'error': {'code': 'woocommerce_rest_term_invalid', 'message': 'Resource does not exist.'}}
+        if item is None:
+            return {'id': item_id, 'error': {'code': 'woocommerce_rest_invalid_id', 'message': 'Invalid ID.'}}
+        return item
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler: type, latency: float, products_count: int) -> None:
+        super().__init__(('127.0.0.1', 0), handler)
+        self.url = f'http://127.0.0.1:{self.server_port}'
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+
+        self.products_count = products_count
+        self.pages = [(path.read_text(encoding='utf-8'), FIXTURE_ARTICLES[path.name])
+                      for path in sorted(FIXTURES_DIR.glob('product_*.html'))]
+        assert all(article in page for page, article in self.pages), 'a fixture lost its article'
+        # every product is in one paged catalog, the first ones are also new
+        self.catalogs = {slug: list(range(i, products_count, len(PAGED_CATALOGS)))
+                         for i, slug in enumerate(PAGED_CATALOGS)}
+        self.catalogs[AJAX_CATALOG] = list(range(min(products_count, 100)))
+
+        self.products = {}
+        self.categories = {}
+        self.last_id = 0
+
+
+def _serve(handler: type, latency: float, products_count: int, connection) -> None:
+    server = StandInServer(handler, latency, products_count)
+    connection.send(server.url)
+    server.serve_forever()
+
+
+def start_server(handler: type, latency: float = 0., products_count: int = 0) -> tuple:
+    """
+    Run a stand-in server in a child process
+    :param latency: seconds added to every response
+    :return: (process, url)
+    """
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.get_context('spawn').Process(
+        target=_serve, args=(handler, latency, products_count, child), daemon=True)
+    process.start()
+    return process, parent.recv()
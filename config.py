@@ -1,3 +1,4 @@
+import os
 from dataclasses import dataclass
 from pathlib import Path
 from environs import Env
@@ -6,8 +7,20 @@ BASE_DIR = Path(__file__).resolve().parent
 
 
 SIMPLY_PARSER_BASE_URL = 'https://simplygreentrade.com'
-SIMPLY_PARSER_AUTH_URL = 'https://simplygreentrade.com/account/'
+SIMPLY_PARSER_AUTH_PATH = '/account/'
+SIMPLY_PARSER_AUTH_URL = SIMPLY_PARSER_BASE_URL + SIMPLY_PARSER_AUTH_PATH
 SIMPLY_PARSER_ITEMS_PER_PAGE = 24
+SIMPLY_PARSER_AJAX_PATH = '/wp-admin/admin-ajax.php'
+SIMPLY_PARSER_ENGINE = 'threads'
+SIMPLY_PARSER_LISTING_WORKERS = 10
+SIMPLY_PARSER_AJAX_BATCH = 5
+SIMPLY_PARSER_EXTRACTOR = 'soup'
+SIMPLY_PARSER_FETCH_WORKERS = 10
+SIMPLY_PARSER_PARSE_PROCESSES = os.cpu_count()
+SIMPLY_PARSER_PARSE_QUEUE_SIZE = 100
+
+SIMPLY_CRAWLER_RATE_LIMIT = 20
+SIMPLY_CRAWLER_TIMEOUT = 60
 
 SIMPLY_PARSER_HEADERS = {
     'authority': 'simplygreentrade.com',
@@ -30,17 +43,144 @@ SIMPLY_PARSER_HEADERS = {
                   '(KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36',
 }
 
+# woodmart_get_products_shortcode request of the infinite scroll feeds,
+# atts[post_type] and paged are set per request
+SIMPLY_PARSER_AJAX_DATA = {
+    'atts[element_title]': '',
+    'atts[layout]': 'grid',
+    'atts[include]': '',
+    'atts[custom_query]': '',
+    'atts[taxonomies]': '',
+    'atts[pagination]': 'infinit',
+    'atts[items_per_page]': '25',
+    'atts[product_hover]': 'standard',
+    'atts[spacing]': '20',
+    'atts[columns]': '5',
+    'atts[columns_tablet]': '3',
+    'atts[columns_mobile]': '2',
+    'atts[sale_countdown]': '0',
+    'atts[stretch_product_desktop]': '0',
+    'atts[stretch_product_tablet]': '0',
+    'atts[stretch_product_mobile]': '0',
+    'atts[stock_progress_bar]': '0',
+    'atts[highlighted_products]': '0',
+    'atts[products_bordered_grid]': '0',
+    'atts[products_bordered_grid_style]': 'outside',
+    'atts[products_with_background]': '0',
+    'atts[products_shadow]': '0',
+    'atts[products_color_scheme]': 'default',
+    'atts[product_quantity]': '0',
+    'atts[grid_gallery]': '',
+    'atts[grid_gallery_control]': '',
+    'atts[grid_gallery_enable_arrows]': '',
+    'atts[offset]': '',
+    'atts[orderby]': 'date',
+    'atts[query_type]': 'OR',
+    'atts[order]': 'DESC',
+    'atts[meta_key]': '',
+    'atts[exclude]': '',
+    'atts[class]': '',
+    'atts[ajax_page]': '',
+    'atts[speed]': '5000',
+    'atts[slides_per_view]': '4',
+    'atts[slides_per_view_tablet]': 'auto',
+    'atts[slides_per_view_mobile]': 'auto',
+    'atts[wrap]': '',
+    'atts[autoplay]': 'no',
+    'atts[center_mode]': 'no',
+    'atts[hide_pagination_control]': '',
+    'atts[hide_prev_next_buttons]': '',
+    'atts[scroll_per_page]': 'yes',
+    'atts[img_size]': 'woocommerce_thumbnail',
+    'atts[force_not_ajax]': 'no',
+    'atts[products_masonry]': '0',
+    'atts[products_different_sizes]': '0',
+    'atts[lazy_loading]': 'yes',
+    'atts[scroll_carousel_init]': 'no',
+    'atts[el_class]': '',
+    'atts[shop_tools]': 'no',
+    'atts[query_post_type]': 'product',
+    'atts[hide_out_of_stock]': 'no',
+    'atts[css]': '',
+    'atts[woodmart_css_id]': '6460f6a67ace8',
+    'atts[ajax_recently_viewed]': 'no',
+    'atts[is_wishlist]': '',
+    'action': 'woodmart_get_products_shortcode',
+    'woo_ajax': '1',
+}
+
 
 SIMPLY_UTILS_MAX_RETRY_FOR_SESSION = 3
 SIMPLY_UTILS_BACK_OFF_FACTOR = 0.3
 SIMPLY_UTILS_ERROR_CODES = (500, 501, 502, 503)
 SIMPLY_UTILS_PROXY_STATE = 0
 
+# AIMD limit of requests in flight, see simply_parser.limiter
+SIMPLY_LIMITER_ENABLED = True
+SIMPLY_LIMITER_INITIAL = 10
+SIMPLY_LIMITER_MIN = 1
+SIMPLY_LIMITER_MAX = 50
+SIMPLY_LIMITER_DECREASE = 0.5
+SIMPLY_LIMITER_LATENCY_FACTOR = 4
+SIMPLY_LIMITER_SLOW_LATENCY = 2
+# the async engine has no adaptive limit, its fixed one is the ceiling of the limiter
+SIMPLY_CRAWLER_CONCURRENCY = SIMPLY_LIMITER_MAX
+
+# connections kept per host, one for every thread that can send at the same time
+SIMPLY_POOL_MAXSIZE = max(SIMPLY_PARSER_LISTING_WORKERS, SIMPLY_PARSER_FETCH_WORKERS)
+SIMPLY_POOL_TCP_KEEPALIVE = True
+
+SIMPLY_CACHE_ENABLED = True
+SIMPLY_CACHE_OFFLINE = False
+SIMPLY_CACHE_PATH = BASE_DIR / '.cache' / 'http'
+SIMPLY_CACHE_TTL = 60 * 60
+SIMPLY_CACHE_MAX_SIZE = 1024 ** 3
+# seconds between writes of the last access of an entry, the eviction order is as coarse
+SIMPLY_CACHE_TOUCH_INTERVAL = 60
+SIMPLY_CACHE_EXCLUDE = (SIMPLY_PARSER_AUTH_URL,)
+
+SIMPLY_METRICS_REPORT_PATH = BASE_DIR / 'metrics.json'
+# Prometheus text file, e.g. in the directory of the node_exporter textfile collector
+SIMPLY_METRICS_PROMETHEUS_PATH = None
+SIMPLY_METRICS_PREFIX = 'sgt'
+SIMPLY_METRICS_SLOWEST = 20
+
+SIMPLY_CHECKPOINT_PATH = BASE_DIR / '.cache' / 'checkpoint.sqlite'
+SIMPLY_SNAPSHOT_PATH = BASE_DIR / 'catalog.snapshot'
+
+# sharded crawl, workers of other machines need the queue file on a share whose byte-range locks work
+# (NFS with lockd, SMB), with broken locks claims can overlap or the file can be corrupted
+SIMPLY_QUEUE_PATH = BASE_DIR / '.cache' / 'queue.sqlite'
+SIMPLY_QUEUE_BATCH = 50
+SIMPLY_QUEUE_STALE_TIMEOUT = 10 * 60
+SIMPLY_QUEUE_MAX_ATTEMPTS = 3
+SIMPLY_QUEUE_POLL_INTERVAL = 5
+SIMPLY_QUEUE_LOCK_TIMEOUT = 60
+
+
+WC_DRIVER_BATCH_SIZE = 100
+WC_DRIVER_BATCH_WORKERS = 4
+WC_DRIVER_TIMEOUT = 60
+# a batch of 100 products with image sideloads takes much longer than a read
+WC_DRIVER_BATCH_TIMEOUT = 300
+WC_DRIVER_PER_PAGE = 100
+WC_DRIVER_FETCH_WORKERS = 4
+WC_DRIVER_HASH_META_KEY = 'sgt_content_hash'
+WC_DRIVER_CACHE_PATH = BASE_DIR / '.cache' / 'wc'
+WC_DRIVER_CATEGORY_CACHE = True
+WC_DRIVER_IMAGE_CACHE = True
+WC_DRIVER_IMAGE_WORKERS = 8
+WC_DRIVER_LIMITER_INITIAL = 4
+WC_DRIVER_LIMITER_MAX = 8
+WC_DRIVER_POOL_MAXSIZE = max(WC_DRIVER_BATCH_WORKERS, WC_DRIVER_FETCH_WORKERS)
+
 
 @dataclass
 class SimplyConfig:
     simply_login: str
     simply_password: str
+    # shop url, another one points the parser to a copy of the shop
+    simply_url: str = SIMPLY_PARSER_BASE_URL
 
 
 @dataclass
@@ -48,6 +188,9 @@ class WoocommerceConfig:
     wc_key: str
     wc_secret: str
     wc_site: str
+    # WordPress user and application password, enable the image pre-upload
+    wp_user: str | None = None
+    wp_password: str | None = None
 
 
 @dataclass
@@ -63,11 +206,14 @@ def load_config(path: str = None) -> Config:
     return Config(
         simply_config=SimplyConfig(
             simply_login=env.str('SIMPLY_LOGIN'),
-            simply_password=env.str('SIMPLY_PASSWORD')
+            simply_password=env.str('SIMPLY_PASSWORD'),
+            simply_url=env.str('SIMPLY_URL', SIMPLY_PARSER_BASE_URL)
         ),
         wc_config=WoocommerceConfig(
             wc_key=env.str('CONSUMER_KEY'),
             wc_secret=env.str('CONSUMER_SECRET'),
-            wc_site=env.str('WC_SITE')
+            wc_site=env.str('WC_SITE'),
+            wp_user=env.str('WP_USER', None),
+            wp_password=env.str('WP_APP_PASSWORD', None)
         )
     )
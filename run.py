@@ -1,21 +1,216 @@
-from simply_parser import SimplyGreenTrade
-from config import BASE_DIR, load_config
-from upload_wc import WooCommerceDriver
+"""
+Copy the simplygreentrade.com catalog to WooCommerce
+
+    python run.py [sync]    crawl the shop and upload the difference to the store
+    python run.py crawl     crawl the shop into the catalog snapshot only
+    python run.py upload    upload the catalog snapshot of the last crawl, --dry-run only counts the changes
+    python run.py refresh   update only price and stock of the products already in the store, --dry-run only counts
+    python run.py worker    parse products of the sharded crawl queue, also from another machine, see SIMPLY_QUEUE_PATH
+    python run.py status    state of the last crawl, nothing is requested
+
+Each command imports only the modules it needs, the parser and the store are authorized on the first request
+"""
+import argparse
+import logging
+import multiprocessing
+import sys
+from pathlib import Path
+
+from config import BASE_DIR, SIMPLY_SNAPSHOT_PATH, SIMPLY_CHECKPOINT_PATH, SIMPLY_METRICS_REPORT_PATH, \
+    SIMPLY_METRICS_PROMETHEUS_PATH, SIMPLY_PARSER_PARSE_PROCESSES, SIMPLY_QUEUE_PATH, Config, load_config
 
 
 def run() -> None:
-    config = load_config(BASE_DIR / '.env')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--metrics', type=Path, default=SIMPLY_METRICS_REPORT_PATH,
+                        help='JSON report of timings and counters of the run')
+    parser.add_argument('--prometheus', type=Path, default=SIMPLY_METRICS_PROMETHEUS_PATH,
+                        help='also write the metrics in the Prometheus text format')
+    commands = parser.add_subparsers(dest='command')
+
+    crawl_options = argparse.ArgumentParser(add_help=False)
+    crawl_options.add_argument('--resume', action='store_true', help='continue the last crawl from its checkpoint')
+    crawl_options.add_argument('--workers', type=int, default=0,
+                               help='sharded crawl: queue the product links and parse them in this many processes')
+    crawl_options.add_argument('--queue', type=Path, default=SIMPLY_QUEUE_PATH, help='work queue of the sharded crawl')
+
+    commands.add_parser('sync', parents=[crawl_options], help='crawl the shop and upload the difference') \
+        .set_defaults(handler=sync)
+    commands.add_parser('crawl', parents=[crawl_options], help='crawl the shop into the catalog snapshot') \
+        .set_defaults(handler=crawl)
+    upload_parser = commands.add_parser('upload', help='upload the catalog snapshot of the last crawl')
+    upload_parser.add_argument('--dry-run', action='store_true',
+                               help='only count the products to create, update and delete')
+    upload_parser.set_defaults(handler=upload)
+    refresh_parser = commands.add_parser('refresh',
+                                         help='update only price and stock of the products already in the store')
+    refresh_parser.add_argument('--dry-run', action='store_true', help='only count the products to update')
+    refresh_parser.set_defaults(handler=refresh)
+    worker_parser = commands.add_parser('worker', help='parse products of the sharded crawl queue')
+    worker_parser.add_argument('--queue', type=Path, default=SIMPLY_QUEUE_PATH)
+    worker_parser.set_defaults(handler=work)
+    commands.add_parser('status', help='state of the last crawl, nothing is requested') \
+        .set_defaults(handler=status, report=False)
+
+    args = parser.parse_args()
+    if args.command is None:
+        args = parser.parse_args(sys.argv[1:] + ['sync'])
+
+    if not getattr(args, 'report', True):
+        args.handler(args)
+        return
+
+    from simply_parser.metrics import metrics
+
+    try:
+        args.handler(args)
+    finally:
+        metrics.write_report(args.metrics)
+        logging.info(f'Metrics report: {args.metrics}')
+        if args.prometheus:
+            metrics.write_prometheus(args.prometheus)
+
 
-    sgt = SimplyGreenTrade(BASE_DIR, config.simply_config)
-    sgt.parse_catalog()
+def iter_crawled(args: argparse.Namespace, config: Config) -> tuple:
+    """
+    Crawl the shop, in one process or sharded over args.workers
+    :return: (SimplyGreenTrade, category slugs, products iterator), failed_count of the first
+        is final once the products are consumed
+    """
+    from simply_parser import SimplyGreenTrade
 
-    catalog_url = sgt.catalog_urls
+    sgt = SimplyGreenTrade(BASE_DIR, config.simply_config, resume=args.resume)
+    if args.workers:
+        from simply_parser.work_queue import WorkQueue
 
-    catalog = [category.split('/')[-2] for category in catalog_url]
+        crawl_sharded(sgt, args)
+        products = WorkQueue(args.queue).iter_products()
+    else:
+        products = sgt.iter_products()
+
+    catalog = [category.split('/')[-2] for category in sgt.get_catalog_urls()]
+    return sgt, catalog, products
+
+
+def sync(args: argparse.Namespace) -> None:
+    from simply_parser.snapshot import SnapshotWriter
+    from upload_wc import WooCommerceDriver
+
+    config = load_config(BASE_DIR / '.env')
+    sgt, catalog, products = iter_crawled(args, config)
 
     wc_driver = WooCommerceDriver(config.wc_config)
     wc_driver.create_category(catalog)
-    wc_driver.add_products(sgt.all_products)
+    with SnapshotWriter(SIMPLY_SNAPSHOT_PATH) as snapshot:
+        wc_driver.sync_products(snapshot.tee(products), allow_delete=lambda: not sgt.failed_count)
+
+
+def crawl(args: argparse.Namespace) -> None:
+    from simply_parser.snapshot import write_snapshot
+
+    sgt, _, products = iter_crawled(args, load_config(BASE_DIR / '.env'))
+    logging.info(f'Snapshot: {write_snapshot(SIMPLY_SNAPSHOT_PATH, products)} products')
+    if sgt.failed_count:
+        logging.warning('The crawl was incomplete, the upload of this snapshot will not delete products')
+
+
+def upload(args: argparse.Namespace) -> None:
+    from simply_parser.checkpoint import CheckpointStore
+    from simply_parser.snapshot import Snapshot
+    from upload_wc import WooCommerceDriver
+
+    config = load_config(BASE_DIR / '.env')
+    # the snapshot is the result of the crawl recorded in the checkpoint store
+    allow_delete = not SIMPLY_CHECKPOINT_PATH.exists() or not CheckpointStore(SIMPLY_CHECKPOINT_PATH).load_failed()
+    with Snapshot(SIMPLY_SNAPSHOT_PATH) as snapshot:
+        catalog = sorted({category for product in snapshot for category in product.categories})
+
+        wc_driver = WooCommerceDriver(config.wc_config)
+        if args.dry_run:
+            # missing categories are not created, products in them count as updates
+            wc_driver.get_all_category()
+        else:
+            wc_driver.create_category(catalog)
+        wc_driver.sync_products(snapshot, dry_run=args.dry_run, allow_delete=allow_delete)
+
+
+def refresh(args: argparse.Namespace) -> None:
+    from simply_parser import SimplyGreenTrade
+    from simply_parser.snapshot import Snapshot
+    from upload_wc import WooCommerceDriver
+
+    config = load_config(BASE_DIR / '.env')
+    # pages are always fetched, the checkpoint of an unfinished crawl is kept and its listing reused
+    sgt = SimplyGreenTrade(BASE_DIR, config.simply_config, resume=True, cache=False)
+    if SIMPLY_SNAPSHOT_PATH.exists():
+        with Snapshot(SIMPLY_SNAPSHOT_PATH) as snapshot:
+            sgt.product_urls = {product.url: product.categories for product in snapshot}
+
+    wc_driver = WooCommerceDriver(config.wc_config)
+    wc_driver.refresh_stock(sgt.iter_stock(), dry_run=args.dry_run)
+
+
+def work(args: argparse.Namespace) -> None:
+    from simply_parser.parse_simply import run_worker
+
+    run_worker(BASE_DIR, load_config(BASE_DIR / '.env').simply_config, args.queue)
+
+
+def crawl_sharded(sgt, args: argparse.Namespace) -> None:
+    """
+    Queue the product links and parse them in args.workers processes, this one included.
+    Workers started with the worker command on other machines join through the same queue file, see SIMPLY_QUEUE_PATH
+    """
+    from simply_parser.parse_simply import run_worker
+    from simply_parser.work_queue import WorkQueue, FAILED
+
+    queue = WorkQueue(args.queue)
+    if not args.resume:
+        queue.clear()
+    sgt.enqueue_products(queue)
+
+    # the workers of this machine share its cpus
+    parse_processes = max(SIMPLY_PARSER_PARSE_PROCESSES // args.workers, 1)
+    sgt.parse_processes = parse_processes
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=run_worker, args=(BASE_DIR, sgt.config, args.queue, parse_processes))
+               for _ in range(args.workers - 1)]
+    for worker in workers:
+        worker.start()
+    sgt.work(queue)
+    for worker in workers:
+        worker.join()
+
+    # released products were parsed again, only the ones out of attempts are missing, besides failed listing pages
+    sgt.failed_count += queue.counts().get(FAILED, 0)
+    sgt.checkpoint.save_failed(sgt.failed_count)
+    if sgt.failed_count:
+        logging.error(f'Unable to parse {sgt.failed_count} products of the queue')
+
+
+def status(args: argparse.Namespace) -> None:
+    from simply_parser.checkpoint import CheckpointStore
+    from simply_parser.snapshot import Snapshot
+    from simply_parser.work_queue import WorkQueue
+
+    if SIMPLY_CHECKPOINT_PATH.exists():
+        counts = CheckpointStore(SIMPLY_CHECKPOINT_PATH).counts()
+        print(f'checkpoint: {counts["catalogs"]} catalogs, {counts["product_urls"]} products found, '
+              f'{counts["products"]} parsed, {counts["failed"]} failed')
+    else:
+        print('checkpoint: none')
+
+    if SIMPLY_QUEUE_PATH.exists():
+        counts = WorkQueue(SIMPLY_QUEUE_PATH).counts()
+        print('queue: ' + (', '.join(f'{count} {state}' for state, count in sorted(counts.items())) or 'empty'))
+    else:
+        print('queue: none')
+
+    if SIMPLY_SNAPSHOT_PATH.exists():
+        with Snapshot(SIMPLY_SNAPSHOT_PATH) as snapshot:
+            print(f'snapshot: {len(snapshot)} products')
+    else:
+        print('snapshot: none')
 
 
 if __name__ == '__main__':
@@ -1 +1,17 @@
-from .parse_simply import SimplyGreenTrade
+import importlib
+
+# names are imported on first access, so that the light modules of the package
+# (snapshot, checkpoint, work_queue) do not pull in the parser and its dependencies
+_EXPORTS = {
+    'SimplyGreenTrade': '.parse_simply',
+    'Product': '.product',
+    'Stock': '.product',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    return getattr(importlib.import_module(_EXPORTS[name], __name__), name)
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from simply_parser.limiter import AdaptiveHTTPAdapter
+from config import SIMPLY_CACHE_TOUCH_INTERVAL
+
+CACHED_HEADERS = ('content-type', 'etag', 'last-modified')
+
+
+class HTTPCache:
+    """
+    On-disk store of response bodies with their validators.
+    The index lives in sqlite, bodies in files named by the request key
+    """
+
+    def __init__(self, path: Path, ttl: float, max_size: int) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path / 'index.sqlite', check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                        'key TEXT PRIMARY KEY, url TEXT, headers TEXT, '
+                        'stored_at REAL, accessed_at REAL, size INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self.db.commit()
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def get_key(request: requests.PreparedRequest) -> str:
+        body = request.body or b''
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        return hashlib.sha1(request.method.encode() + b' ' + request.url.encode() + b' ' + body).hexdigest()
+
+    def _body_path(self, key: str) -> Path:
+        return self.path / key[:2] / key
+
+    def get(self, key: str) -> dict | None:
+        """
+        The body is read outside the lock, the access time is written
+        at most every SIMPLY_CACHE_TOUCH_INTERVAL seconds per entry
+        :return: {'headers', 'body', 'fresh'} | None
+        """
+        with self.lock:
+            row = self.db.execute('SELECT headers, stored_at, accessed_at FROM responses WHERE key = ?',
+                                  (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            body = self._body_path(key).read_bytes()
+        except FileNotFoundError:
+            with self.lock:
+                self._delete(key)
+                self.db.commit()
+            return None
+        now = time.time()
+        if now - row[2] >= SIMPLY_CACHE_TOUCH_INTERVAL:
+            with self.lock:
+                self.db.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+                self.db.commit()
+        return {'headers': json.loads(row[0]), 'body': body, 'fresh': now - row[1] < self.ttl}
+
+    def put(self, key: str, url: str, headers: dict, body: bytes) -> None:
+        body_path = self._body_path(key)
+        body_path.parent.mkdir(exist_ok=True)
+        tmp_path = body_path.with_suffix(f'.{threading.get_ident()}.tmp')
+        tmp_path.write_bytes(body)
+        os.replace(tmp_path, body_path)
+
+        now = time.time()
+        with self.lock:
+            row = self.db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self.size += len(body) - (row[0] if row else 0)
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                            (key, url, json.dumps(headers), now, now, len(body)))
+            self._evict()
+            self.db.commit()
+
+    def touch(self, key: str) -> None:
+        """
+        Mark an entry as fresh again after a 304
+        """
+        with self.lock:
+            now = time.time()
+            self.db.execute('UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?', (now, now, key))
+            self.db.commit()
+
+    def _delete(self, key: str) -> None:
+        row = self.db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return
+        self.size -= row[0]
+        self.db.execute('DELETE FROM responses WHERE key = ?', (key,))
+        self._body_path(key).unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        """
+        Drop least recently used entries until the cache fits max_size
+        """
+        while self.size > self.max_size:
+            keys = [row[0] for row in self.db.execute(
+                'SELECT key FROM responses ORDER BY accessed_at LIMIT 100')]
+            if not keys:
+                break
+            for key in keys:
+                self._delete(key)
+                if self.size <= self.max_size:
+                    break
+
+
+class CachingHTTPAdapter(AdaptiveHTTPAdapter):
+    """
+    HTTPAdapter serving responses from HTTPCache. Fresh entries are returned
+    without a request, stale ones are revalidated with If-None-Match /
+    If-Modified-Since. In offline mode only the cache is used
+    """
+
+    def __init__(self, cache: HTTPCache, offline: bool = False, exclude: tuple = (), **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.cache = cache
+        self.offline = offline
+        self.exclude = exclude
+
+    @staticmethod
+    def _build_cached_response(request: requests.PreparedRequest, entry: dict) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = entry['body']
+        response.url = request.url
+        response.request = request
+        response.from_cache = True
+        return response
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if request.method not in ('GET', 'POST') or request.url in self.exclude:
+            return super().send(request, **kwargs)
+
+        key = self.cache.get_key(request)
+        entry = self.cache.get(key)
+        if entry and (entry['fresh'] or self.offline):
+            return self._build_cached_response(request, entry)
+        if self.offline:
+            raise requests.exceptions.ConnectionError(f'{request.url} is not cached, offline mode')
+
+        if entry and request.method == 'GET':
+            if 'etag' in entry['headers']:
+                request.headers['If-None-Match'] = entry['headers']['etag']
+            if 'last-modified' in entry['headers']:
+                request.headers['If-Modified-Since'] = entry['headers']['last-modified']
+
+        response = super().send(request, **kwargs)
+        if response.status_code == 304 and entry:
+            self.cache.touch(key)
+            return self._build_cached_response(request, entry)
+        if response.status_code == 200:
+            headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+            self.cache.put(key, request.url, headers, response.content)
+        return response
@@ -0,0 +1,94 @@
+import json
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from typing import Iterator
+
+from simply_parser.product import Product
+
+
+class CheckpointStore:
+    """
+    Crawl progress in sqlite: catalog links, discovered product links
+    and parsed products, written as they complete
+    """
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS product_urls (url TEXT PRIMARY KEY, categories TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS products (url TEXT PRIMARY KEY, product TEXT)')
+        self.db.commit()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.db.execute('DELETE FROM state')
+            self.db.execute('DELETE FROM product_urls')
+            self.db.execute('DELETE FROM products')
+            self.db.commit()
+
+    def save_listing(self, catalog_urls: list, product_urls: dict) -> None:
+        """
+        Record the result of the listing stage
+        """
+        with self.lock:
+            self.db.execute('DELETE FROM product_urls')
+            self.db.executemany('INSERT INTO product_urls VALUES (?, ?)',
+                                ((url, json.dumps(categories)) for url, categories in product_urls.items()))
+            self.db.execute('INSERT OR REPLACE INTO state VALUES (?, ?)', ('catalog_urls', json.dumps(catalog_urls)))
+            self.db.commit()
+
+    def load_listing(self) -> tuple | None:
+        """
+        :return: (catalog_urls, product_urls) | None if the listing stage was not finished
+        """
+        with self.lock:
+            row = self.db.execute("SELECT value FROM state WHERE key = 'catalog_urls'").fetchone()
+            if row is None:
+                return None
+            product_urls = {url: [sys.intern(category) for category in json.loads(categories)]
+                            for url, categories in self.db.execute('SELECT url, categories FROM product_urls')}
+        return json.loads(row[0]), product_urls
+
+    def save_failed(self, failed_count: int) -> None:
+        """
+        Record how many products or catalogs the crawl was unable to parse
+        """
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO state VALUES (?, ?)', ('failed_count', json.dumps(failed_count)))
+            self.db.commit()
+
+    def load_failed(self) -> int:
+        with self.lock:
+            row = self.db.execute("SELECT value FROM state WHERE key = 'failed_count'").fetchone()
+        return json.loads(row[0]) if row else 0
+
+    def counts(self) -> dict:
+        """
+        :return: numbers of catalogs, discovered product links, parsed products and failures
+        """
+        with self.lock:
+            row = self.db.execute("SELECT value FROM state WHERE key = 'catalog_urls'").fetchone()
+            counts = {
+                'catalogs': len(json.loads(row[0])) if row else 0,
+                'product_urls': self.db.execute('SELECT COUNT(*) FROM product_urls').fetchone()[0],
+                'products': self.db.execute('SELECT COUNT(*) FROM products').fetchone()[0],
+            }
+        counts['failed'] = self.load_failed()
+        return counts
+
+    def save_product(self, product: Product) -> None:
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO products VALUES (?, ?)',
+                            (product.url, json.dumps(product.to_dict(), ensure_ascii=False)))
+            self.db.commit()
+
+    def iter_products(self) -> Iterator[Product]:
+        cursor = self.db.cursor()
+        for row in cursor.execute('SELECT product FROM products'):
+            yield Product.from_dict(json.loads(row[0]))
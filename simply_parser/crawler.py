@@ -0,0 +1,241 @@
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Iterator
+from urllib.parse import urlsplit
+
+import aiohttp
+from tqdm import tqdm
+
+from simply_parser.limiter import THROTTLE_CODES, get_retry_after
+from simply_parser.metrics import metrics
+from simply_parser.product import Product
+from simply_parser.utils import get_ajax_data, get_canonical_url
+from config import SIMPLY_PARSER_HEADERS, SIMPLY_PARSER_AJAX_BATCH, \
+    SIMPLY_CRAWLER_CONCURRENCY, SIMPLY_CRAWLER_RATE_LIMIT, SIMPLY_CRAWLER_TIMEOUT, SIMPLY_PARSER_PARSE_QUEUE_SIZE, \
+    SIMPLY_UTILS_MAX_RETRY_FOR_SESSION, SIMPLY_UTILS_BACK_OFF_FACTOR, SIMPLY_UTILS_ERROR_CODES
+
+
+class HostRateLimiter:
+    """
+    Spaces requests to the same host at least 1 / rate seconds apart
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate if rate else 0
+        self.next_slot = defaultdict(float)
+
+    async def wait(self, url: str) -> None:
+        host = urlsplit(url).netloc
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self.next_slot[host])
+        self.next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class AsyncCrawler:
+    """
+    Asyncio crawler of https://simplygreentrade.com/ working with the cookies
+    of an authorized SimplyGreenTrade. Listing pages feed product links
+    straight into the detail workers
+    """
+
+    def __init__(self, sgt, concurrency: int = SIMPLY_CRAWLER_CONCURRENCY,
+                 rate_limit: float = SIMPLY_CRAWLER_RATE_LIMIT, sink: Callable[[Product], None] = None,
+                 skip: set = frozenset()) -> None:
+        """
+        :param sink: blocking callback receiving parsed products, they are kept in self.products without it
+        :param skip: links of products that are already parsed
+        """
+        self.sgt = sgt
+        self.sink = sink
+        self.skip = skip
+        self.concurrency = concurrency
+        self.rate_limiter = HostRateLimiter(rate_limit)
+        self.semaphore = None
+        self.session = None
+        self.queue = None
+        self.progress = None
+        self.products = []
+
+    async def _fetch(self, method: str, url: str, **kwargs) -> str:
+        """
+        Request with the global concurrency limit, the host rate limit
+        and the same retry policy as get_session, Retry-After of throttled responses is honored.
+        An error status after the last retry raises aiohttp.ClientResponseError
+        """
+        attempt = 0
+        while True:
+            retry_after = None
+            async with self.semaphore:
+                await self.rate_limiter.wait(url)
+                try:
+                    start = time.perf_counter()
+                    async with self.session.request(method, url, **kwargs) as response:
+                        metrics.count('requests', client='shop', status=response.status)
+                        if response.status not in SIMPLY_UTILS_ERROR_CODES + THROTTLE_CODES \
+                                or attempt >= SIMPLY_UTILS_MAX_RETRY_FOR_SESSION:
+                            body = await response.read()
+                            metrics.count('response_bytes', len(body), client='shop')
+                            metrics.observe('shop_request', time.perf_counter() - start, url)
+                            # a page that still fails is an error, not an empty catalog or product
+                            response.raise_for_status()
+                            return body.decode(response.get_encoding())
+                        if response.status in THROTTLE_CODES:
+                            metrics.count('throttled', client='shop')
+                            retry_after = get_retry_after(response.headers.get('Retry-After'))
+                except aiohttp.ClientResponseError:
+                    raise
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    if attempt >= SIMPLY_UTILS_MAX_RETRY_FOR_SESSION:
+                        raise
+            metrics.count('retries', client='shop')
+            await asyncio.sleep(retry_after if retry_after is not None else SIMPLY_UTILS_BACK_OFF_FACTOR * 2 ** attempt)
+            attempt += 1
+
+    async def _add_product_urls(self, cur_product_urls: list, catalog: str) -> None:
+        for cur_product_url in cur_product_urls:
+            if self.sgt._add_product_url(cur_product_url, catalog):
+                await self._queue_product(get_canonical_url(cur_product_url))
+
+    async def _queue_product(self, url: str) -> None:
+        if url in self.skip:
+            return
+        self.progress.total += 1
+        # the categories list is shared with the index and keeps growing
+        # while other catalogs are crawled
+        await self.queue.put((url, self.sgt.product_urls[url]))
+
+    async def _crawl_catalog(self, catalog: str) -> None:
+        html = await self._fetch('GET', catalog)
+        pagination = self.sgt._extract_pagination(html, catalog)
+
+        if pagination is None:
+            return
+        elif pagination[0] == 'ajax':
+            async def crawl_ajax_page(page: int) -> list | None:
+                response = await self._fetch('POST', self.sgt.ajax_url, data=get_ajax_data(pagination[1], page))
+                return self.sgt._extract_ajax_urls(json.loads(response))
+
+            page = 1
+            while True:
+                tasks = [asyncio.create_task(crawl_ajax_page(page + i)) for i in range(SIMPLY_PARSER_AJAX_BATCH)]
+                page += SIMPLY_PARSER_AJAX_BATCH
+                for task in tasks:
+                    cur_product_urls = await task
+                    if cur_product_urls is None:
+                        for rest in tasks:
+                            rest.cancel()
+                        return
+                    await self._add_product_urls(cur_product_urls, catalog)
+        else:
+            page_strip, pages_count = pagination
+            logging.info(f'{catalog} total pages: {pages_count}')
+
+            async def crawl_page(page: int) -> None:
+                html = await self._fetch('GET', catalog + f'{page_strip}{page}')
+                await self._add_product_urls(self.sgt._extract_listing_urls(html), catalog)
+
+            await asyncio.gather(*(crawl_page(page) for page in range(1, pages_count + 1)))
+
+    async def _detail_worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            url, categories = await self.queue.get()
+            try:
+                html = await self._fetch('GET', url)
+                start = time.perf_counter()
+                product = await loop.run_in_executor(None, self.sgt._extract_details, html, url, categories)
+                metrics.observe('product_parse', time.perf_counter() - start, url)
+                if product:
+                    if self.sink:
+                        await loop.run_in_executor(None, self.sink, product)
+                    else:
+                        self.products.append(product)
+                else:
+                    self.sgt.failed_count += 1
+            except Exception:
+                logging.exception(f'Unable to parse {url}')
+                self.sgt.failed_count += 1
+            finally:
+                self.progress.update()
+                self.queue.task_done()
+
+    async def crawl(self) -> list:
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.queue = asyncio.Queue()
+        self.progress = tqdm(total=0)
+
+        cookies = {cookie.name: cookie.value for cookie in self.sgt.session.cookies}
+        self.session = aiohttp.ClientSession(
+            cookies=cookies,
+            headers={'user-agent': SIMPLY_PARSER_HEADERS['user-agent']},
+            timeout=aiohttp.ClientTimeout(total=SIMPLY_CRAWLER_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=self.concurrency)
+        )
+        async with self.session:
+            if not self.sgt.catalog_urls:
+                self.sgt.catalog_urls = self.sgt._extract_catalog_urls(await self._fetch('GET', self.sgt.base_url))
+                logging.info(f'Total catalogs found: {len(self.sgt.catalog_urls)}')
+
+            workers = [asyncio.create_task(self._detail_worker()) for _ in range(self.concurrency)]
+            if self.sgt.product_urls:
+                # the listing recorded by the resumed crawl is complete, the catalogs are not crawled again
+                for url in list(self.sgt.product_urls):
+                    await self._queue_product(url)
+            else:
+                results = await asyncio.gather(*(self._crawl_catalog(catalog) for catalog in self.sgt.catalog_urls),
+                                               return_exceptions=True)
+                failed_catalogs = 0
+                for catalog, result in zip(self.sgt.catalog_urls, results):
+                    if isinstance(result, Exception):
+                        logging.error(f'Unable to parse {catalog}: {result!r}')
+                        failed_catalogs += 1
+                self.sgt.failed_count += failed_catalogs
+                # an incomplete listing is not recorded, a resumed crawl lists the catalogs again
+                if not failed_catalogs:
+                    self.sgt.checkpoint.save_listing(self.sgt.catalog_urls, self.sgt.product_urls)
+            logging.info(f'Total products found: {len(self.sgt.product_urls)}')
+
+            await self.queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        self.progress.close()
+        return self.products
+
+    def run(self) -> list:
+        return asyncio.run(self.crawl())
+
+    def iter_products(self) -> Iterator[Product]:
+        """
+        Run the crawl in a background thread and yield products as they are parsed.
+        The queue between them holds SIMPLY_PARSER_PARSE_QUEUE_SIZE products,
+        when it is full the detail workers wait for the consumer
+        """
+        products = queue.Queue(maxsize=SIMPLY_PARSER_PARSE_QUEUE_SIZE)
+        finished = object()
+        errors = []
+
+        def crawl() -> None:
+            try:
+                self.run()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                products.put(finished)
+
+        self.sink = products.put
+        thread = threading.Thread(target=crawl, daemon=True)
+        thread.start()
+        while (product := products.get()) is not finished:
+            yield product
+        thread.join()
+        if errors:
+            raise errors[0]
@@ -0,0 +1,212 @@
+import logging
+
+import lxml.html
+from bs4 import BeautifulSoup
+from lxml import etree
+
+from simply_parser.product import Product, Stock
+
+
+def extract_details_soup(html: str, url: str, categories: list) -> Product | None:
+    """
+    Extract product details with BeautifulSoup
+    :param html: product page
+    :param url: current link
+    :param categories: categories of the product
+    :return: Product | None
+    """
+    soup = BeautifulSoup(html, 'lxml')
+
+    name = soup.find('h1', class_='product_title').text.strip()
+    try:
+        brand = soup.find('tr',
+                          class_='woocommerce-product-attributes-'
+                                 'item--attribute_pa_brand').find('td',
+                                                                  class_='woocommerce-product-'
+                                                                         'attributes-item__value').text.strip()
+    except:
+        brand = name.split(' ')[0]
+
+    try:
+        description = soup.find('div', class_='wd-single-content').extract()
+        if description.find('h2'):
+            description.find('h2').extract()
+        description = description.text.strip()
+    except:
+        description = None
+
+    breadcrumbs = [x.text.strip() for x in soup.find('nav', class_='woocommerce-breadcrumb').find_all('a', 'breadcrumb-link')[1:]]
+    artcile = soup.find('div', class_='sku-single').text.strip()
+    price = float(soup.find('p', class_='price').find('span', class_='woocommerce-Price-amount').text.strip().replace('.', '').replace(',', '.').replace('€', ''))
+    image = soup.find('figure', class_='woocommerce-product-gallery__image').find('a')['href']
+
+    is_available_text = soup.find('div', class_='detailed-info-stock').find('div', class_='wpb_wrapper').text.strip()
+    if is_available_text == 'Available' or is_available_text == 'Limited stock':
+        is_available = True
+    elif is_available_text == 'Sold out' or is_available_text == 'Out of stock':
+        is_available = False
+    else:
+        logging.error(f'%%%%%%%%%%%%%NEW AVAILABLE STATUS%%%%%%%%%%%%%%%%%%%{is_available_text}')
+        return None
+
+    if is_available:
+        in_stock = soup.find('div', class_='quantity').find('input', class_='input-text')['max']
+    else:
+        in_stock = 0
+
+    features = [(x.find('th').text.strip(), x.find('td').text.strip())
+                for x in soup.find('table', class_='woocommerce-product-attributes').find_all('tr')]
+
+    return Product(
+        url=url,
+        article=artcile,
+        name=name,
+        brand=brand,
+        image=image,
+        price=price,
+        is_available=is_available,
+        in_stock=in_stock,
+        breadcrumbs=breadcrumbs,
+        description=description,
+        features=features,
+        categories=categories
+    )
+
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# BeautifulSoup leaves script, style and template strings out of .text
+_TEXT = etree.XPath('.//text()[not(ancestor::script or ancestor::style or ancestor::template)]')
+_NAME = etree.XPath(f"//h1[{_has_class('product_title')}]")
+_BRAND = etree.XPath(f"(//tr[{_has_class('woocommerce-product-attributes-item--attribute_pa_brand')}])[1]"
+                     f"//td[{_has_class('woocommerce-product-attributes-item__value')}]")
+_DESCRIPTION = etree.XPath(f"//div[{_has_class('wd-single-content')}]")
+_BREADCRUMBS = etree.XPath(f"(//nav[{_has_class('woocommerce-breadcrumb')}])[1]//a[{_has_class('breadcrumb-link')}]")
+_SKU = etree.XPath(f"//div[{_has_class('sku-single')}]")
+_PRICE = etree.XPath(f"(//p[{_has_class('price')}])[1]//span[{_has_class('woocommerce-Price-amount')}]")
+_IMAGE = etree.XPath(f"(//figure[{_has_class('woocommerce-product-gallery__image')}])[1]//a")
+_AVAILABLE = etree.XPath(f"(//div[{_has_class('detailed-info-stock')}])[1]//div[{_has_class('wpb_wrapper')}]")
+_IN_STOCK = etree.XPath(f"(//div[{_has_class('quantity')}])[1]//input[{_has_class('input-text')}]")
+_FEATURES = etree.XPath(f"(//table[{_has_class('woocommerce-product-attributes')}])[1]//tr")
+
+
+def _text(element) -> str:
+    return ''.join(_TEXT(element)).strip()
+
+
+def extract_details_lxml(html: str, url: str, categories: list) -> Product | None:
+    """
+    Extract product details with lxml.html and precompiled XPath,
+    gives the same result as extract_details_soup
+    :param html: product page
+    :param url: current link
+    :param categories: categories of the product
+    :return: Product | None
+    """
+    root = lxml.html.document_fromstring(html)
+
+    name = _text(_NAME(root)[0])
+    brand = _BRAND(root)
+    brand = _text(brand[0]) if brand else name.split(' ')[0]
+
+    description = _DESCRIPTION(root)
+    if description:
+        description = description[0]
+        title = description.xpath('.//h2')
+        if title:
+            title[0].drop_tree()
+        # removed like soup.extract(), the rest of the lookups do not see it
+        description.drop_tree()
+        description = _text(description)
+    else:
+        description = None
+
+    breadcrumbs = [_text(x) for x in _BREADCRUMBS(root)[1:]]
+    artcile = _text(_SKU(root)[0])
+    price = float(_text(_PRICE(root)[0]).replace('.', '').replace(',', '.').replace('€', ''))
+    image = _IMAGE(root)[0].attrib['href']
+
+    is_available_text = _text(_AVAILABLE(root)[0])
+    if is_available_text == 'Available' or is_available_text == 'Limited stock':
+        is_available = True
+    elif is_available_text == 'Sold out' or is_available_text == 'Out of stock':
+        is_available = False
+    else:
+        logging.error(f'%%%%%%%%%%%%%NEW AVAILABLE STATUS%%%%%%%%%%%%%%%%%%%{is_available_text}')
+        return None
+
+    if is_available:
+        in_stock = _IN_STOCK(root)[0].attrib['max']
+    else:
+        in_stock = 0
+
+    features = [(_text(x.xpath('.//th')[0]), _text(x.xpath('.//td')[0])) for x in _FEATURES(root)]
+
+    return Product(
+        url=url,
+        article=artcile,
+        name=name,
+        brand=brand,
+        image=image,
+        price=price,
+        is_available=is_available,
+        in_stock=in_stock,
+        breadcrumbs=breadcrumbs,
+        description=description,
+        features=features,
+        categories=categories
+    )
+
+
+def extract_stock_lxml(html: str, url: str) -> Stock | None:
+    """
+    Extract only article, price and stock, the rest of the page is not looked at
+    :param html: product page
+    :param url: current link
+    :return: Stock | None
+    """
+    root = lxml.html.document_fromstring(html)
+
+    price = float(_text(_PRICE(root)[0]).replace('.', '').replace(',', '.').replace('€', ''))
+    is_available_text = _text(_AVAILABLE(root)[0])
+    if is_available_text == 'Available' or is_available_text == 'Limited stock':
+        is_available = True
+    elif is_available_text == 'Sold out' or is_available_text == 'Out of stock':
+        is_available = False
+    else:
+        logging.error(f'%%%%%%%%%%%%%NEW AVAILABLE STATUS%%%%%%%%%%%%%%%%%%%{is_available_text}')
+        return None
+
+    return Stock(
+        url=url,
+        article=_text(_SKU(root)[0]),
+        price=price,
+        is_available=is_available,
+        in_stock=_IN_STOCK(root)[0].attrib['max'] if is_available else 0
+    )
+
+
+EXTRACTORS = {
+    'soup': extract_details_soup,
+    'lxml': extract_details_lxml,
+}
+
+
+def extract_details(content: bytes, encoding: str | None, url: str, categories: list,
+                    extractor: str) -> Product | None:
+    """
+    Entry point of the parse processes, works on the raw page
+    :param content: product page body
+    :param encoding: encoding of the response, utf-8 if unknown
+    """
+    html = content.decode(encoding or 'utf-8', errors='replace')
+    return EXTRACTORS[extractor](html, url, categories)
+
+
+def extract_stock(content: bytes, encoding: str | None, url: str, categories: list) -> Stock | None:
+    """
+    Entry point of the parse processes for a price and stock refresh
+    """
+    return extract_stock_lxml(content.decode(encoding or 'utf-8', errors='replace'), url)
@@ -0,0 +1,180 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from functools import partial
+from typing import Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from simply_parser.metrics import metrics
+from config import SIMPLY_LIMITER_MIN, SIMPLY_LIMITER_DECREASE, SIMPLY_LIMITER_LATENCY_FACTOR, \
+    SIMPLY_LIMITER_SLOW_LATENCY, SIMPLY_UTILS_MAX_RETRY_FOR_SESSION, SIMPLY_UTILS_BACK_OFF_FACTOR, \
+    SIMPLY_UTILS_ERROR_CODES
+
+THROTTLE_CODES = (429, 503)
+
+
+def get_retry_after(value: str | None) -> float | None:
+    """
+    Seconds to wait from a Retry-After header, given in seconds or as an http date
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    AIMD controller of the requests in flight to one server.
+    The limit grows by one per limit successful responses while it is the cap on the
+    requests in flight, and is multiplied by SIMPLY_LIMITER_DECREASE on throttling,
+    server errors, connection errors and slow responses, at most once per round trip.
+    Only timed requests are compared to the best latency, writes of very different
+    sizes are not. Retry-After pauses every request
+    """
+
+    def __init__(
+            self,
+            initial: int,
+            maximum: int,
+            name: str = 'http',
+            minimum: int = SIMPLY_LIMITER_MIN,
+            retries: int = SIMPLY_UTILS_MAX_RETRY_FOR_SESSION,
+            back_off_factor: float = SIMPLY_UTILS_BACK_OFF_FACTOR,
+            status_force_list: tuple = SIMPLY_UTILS_ERROR_CODES
+    ) -> None:
+        """
+        :param name: client name in the metrics
+        """
+        self.name = name
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.retries = retries
+        self.back_off_factor = back_off_factor
+        self.status_force_list = frozenset(status_force_list) | frozenset(THROTTLE_CODES)
+
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.paused_until = 0.
+        self.last_decrease = 0.
+        self.best_latency = None
+
+    def acquire(self) -> float:
+        """
+        Wait for a free slot
+        :return: start time of the request
+        """
+        with self.condition:
+            while True:
+                delay = self.paused_until - time.monotonic()
+                if delay <= 0 and self.in_flight < int(self.limit):
+                    break
+                self.condition.wait(delay if delay > 0 else None)
+            self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, started: float, ok: bool, retry_after: float = None, timed: bool = True) -> None:
+        """
+        Free the slot and adjust the limit
+        :param started: value returned by acquire
+        :param ok: the server answered normally
+        :param retry_after: seconds the server asked to wait
+        :param timed: the latency of the request is a signal of the server load
+        """
+        with self.condition:
+            # the callers, not the limit, cap the requests when the limit is not reached
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            now = time.monotonic()
+            latency = now - started
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+
+            if ok and timed:
+                self.best_latency = latency if self.best_latency is None else min(self.best_latency, latency)
+                ok = latency <= max(self.best_latency * SIMPLY_LIMITER_LATENCY_FACTOR, SIMPLY_LIMITER_SLOW_LATENCY)
+
+            if ok:
+                if saturated:
+                    self.limit = min(self.limit + 1 / self.limit, self.maximum)
+            elif started > self.last_decrease:
+                # requests sent before the last decrease saw the old limit
+                self.limit = max(self.limit * SIMPLY_LIMITER_DECREASE, self.minimum)
+                self.last_decrease = now
+            metrics.set('concurrency_limit', round(self.limit, 2), client=self.name)
+            self.condition.notify_all()
+
+    def call(self, send: Callable[[], requests.Response], idempotent: bool = True) -> requests.Response:
+        """
+        Send a request within the limit, retrying connection errors, server errors
+        and throttling with exponential back off or the Retry-After of the server
+        :param send: function making the request
+        :param idempotent: False retries only throttled requests, which the server did not process,
+            and leaves the request out of the latency signal
+        """
+        attempt = 0
+        while True:
+            started = self.acquire()
+            try:
+                response = send()
+            except (requests.ConnectionError, requests.Timeout):
+                self.release(started, ok=False, timed=idempotent)
+                if attempt >= self.retries or not idempotent:
+                    raise
+                retry_after = None
+            except BaseException:
+                # any other error is not retried, the slot must not leak
+                self.release(started, ok=False, timed=False)
+                raise
+            else:
+                retry_after = get_retry_after(response.headers.get('Retry-After')) \
+                    if response.status_code in THROTTLE_CODES else None
+                if response.status_code in THROTTLE_CODES:
+                    metrics.count('throttled', client=self.name)
+                failed = response.status_code in self.status_force_list
+                self.release(started, ok=not failed, retry_after=retry_after, timed=idempotent)
+                retry = failed if idempotent else response.status_code in THROTTLE_CODES
+                if not retry or attempt >= self.retries:
+                    return response
+                response.close()
+
+            metrics.count('retries', client=self.name)
+            time.sleep(retry_after if retry_after is not None else self.back_off_factor * 2 ** attempt)
+            attempt += 1
+
+
+class AdaptiveHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter sending through an AdaptiveLimiter, which also does the retries
+    """
+
+    def __init__(self, limiter: AdaptiveLimiter = None, unsafe_methods: tuple = (),
+                 socket_options: list = None, **kwargs) -> None:
+        """
+        :param unsafe_methods: methods retried only when throttled
+        :param socket_options: socket options of the pooled connections
+        """
+        self.limiter = limiter
+        self.unsafe_methods = unsafe_methods
+        self.socket_options = socket_options
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        if self.socket_options is not None:
+            kwargs['socket_options'] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        send = partial(super().send, request, **kwargs)
+        if self.limiter is None:
+            return send()
+        return self.limiter.call(send, idempotent=request.method not in self.unsafe_methods)
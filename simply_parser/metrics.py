@@ -0,0 +1,152 @@
+"""
+Timers and counters of one run.
+
+Stages are timed with metrics.timer(stage, url) or metrics.observe, counters and gauges
+take optional labels. The run report is JSON, metrics can also be exported
+in the Prometheus text format
+"""
+import heapq
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterator
+
+from config import SIMPLY_METRICS_SLOWEST, SIMPLY_METRICS_PREFIX
+
+if TYPE_CHECKING:
+    import requests
+
+
+def get_key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{label}="{value}"' for label, value in sorted(labels.items())) + '}'
+
+
+def call_timed(function: Callable, *args) -> tuple:
+    """
+    Call function and measure it, used for work sent to other processes
+    :return: (result, seconds)
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+class Metrics:
+    """
+    Thread safe registry of stage timings, counters, gauges and the slowest urls
+    """
+
+    def __init__(self, slowest_count: int = SIMPLY_METRICS_SLOWEST) -> None:
+        self.slowest_count = slowest_count
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.started = datetime.now(timezone.utc)
+            self.start = time.perf_counter()
+            self.stages = defaultdict(lambda: {'count': 0, 'seconds': 0., 'max_seconds': 0.})
+            self.counters = defaultdict(float)
+            self.gauges = {}
+            self.slowest = []
+
+    def observe(self, stage: str, seconds: float, url: str = None) -> None:
+        with self.lock:
+            timing = self.stages[stage]
+            timing['count'] += 1
+            timing['seconds'] += seconds
+            timing['max_seconds'] = max(timing['max_seconds'], seconds)
+            if url is not None:
+                item = (seconds, stage, url)
+                if len(self.slowest) < self.slowest_count:
+                    heapq.heappush(self.slowest, item)
+                elif item > self.slowest[0]:
+                    heapq.heapreplace(self.slowest, item)
+
+    @contextmanager
+    def timer(self, stage: str, url: str = None) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, url)
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        with self.lock:
+            self.counters[get_key(name, labels)] += value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self.lock:
+            self.gauges[get_key(name, labels)] = value
+
+    def response_hook(self, client: str) -> Callable:
+        """
+        requests response hook counting requests, statuses, bytes and cache hits of a client
+        """
+        def hook(response: 'requests.Response', *args, **kwargs) -> None:
+            from_cache = getattr(response, 'from_cache', False)
+            self.count('requests', client=client, status=response.status_code)
+            if from_cache:
+                self.count('cache_hits', client=client)
+            else:
+                self.count('response_bytes', len(response.content), client=client)
+                self.observe(f'{client}_request', response.elapsed.total_seconds(), response.url)
+        return hook
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                'started': self.started.isoformat(),
+                'seconds': round(time.perf_counter() - self.start, 3),
+                'stages': {stage: {
+                    'count': timing['count'],
+                    'seconds': round(timing['seconds'], 3),
+                    'mean_ms': round(timing['seconds'] / timing['count'] * 1000, 1),
+                    'max_ms': round(timing['max_seconds'] * 1000, 1),
+                } for stage, timing in sorted(self.stages.items())},
+                'counters': dict(sorted(self.counters.items())),
+                'gauges': dict(sorted(self.gauges.items())),
+                'slowest': [{'stage': stage, 'url': url, 'ms': round(seconds * 1000, 1)}
+                            for seconds, stage, url in sorted(self.slowest, reverse=True)],
+            }
+
+    def to_prometheus(self, prefix: str = SIMPLY_METRICS_PREFIX) -> str:
+        lines = []
+        with self.lock:
+            stages = sorted(self.stages.items())
+            for suffix, field in (('stage_seconds_total', 'seconds'), ('stage_calls_total', 'count')):
+                lines.append(f'# TYPE {prefix}_{suffix} counter')
+                lines += [f'{prefix}_{suffix}{{stage="{stage}"}} {timing[field]}' for stage, timing in stages]
+
+            for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+                typed = set()
+                # lines of one metric are kept together
+                for key, value in sorted(values.items(), key=lambda item: (item[0].partition('{')[0], item[0])):
+                    name, brace, labels = key.partition('{')
+                    name += '_total' if kind == 'counter' else ''
+                    labels = brace + labels
+                    if name not in typed:
+                        typed.add(name)
+                        lines.append(f'# TYPE {prefix}_{name} {kind}')
+                    lines.append(f'{prefix}_{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.report(), indent=2), encoding='utf-8')
+
+    def write_prometheus(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(self.to_prometheus(), encoding='utf-8')
+        tmp_path.replace(path)
+
+
+# metrics of the current run
+metrics = Metrics()
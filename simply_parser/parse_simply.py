@@ -1,14 +1,31 @@
 import json
 import logging
 import concurrent.futures
+import multiprocessing
 import math
+import os
+import socket
+import sys
+import threading
+import time
+from functools import partial
+from typing import Callable, Iterator
+import requests
 from tqdm import tqdm
 from bs4 import BeautifulSoup
-from pathlib import WindowsPath
+from pathlib import Path, WindowsPath
 
-from simply_parser.utils import get_session
-from config import SIMPLY_PARSER_HEADERS, SIMPLY_PARSER_BASE_URL, \
-    SIMPLY_PARSER_AUTH_URL, SIMPLY_PARSER_ITEMS_PER_PAGE, SimplyConfig
+from simply_parser.checkpoint import CheckpointStore
+from simply_parser.extractors import EXTRACTORS, extract_details, extract_stock
+from simply_parser.metrics import metrics, call_timed
+from simply_parser.product import Product, Stock
+from simply_parser.utils import get_session, get_ajax_data, get_canonical_url, log_pool_stats
+from simply_parser.work_queue import WorkQueue, PENDING, CLAIMED
+from config import SIMPLY_PARSER_HEADERS, SIMPLY_PARSER_AJAX_PATH, \
+    SIMPLY_PARSER_AUTH_PATH, SIMPLY_PARSER_ITEMS_PER_PAGE, SIMPLY_PARSER_ENGINE, SIMPLY_PARSER_LISTING_WORKERS, \
+    SIMPLY_PARSER_AJAX_BATCH, SIMPLY_PARSER_EXTRACTOR, SIMPLY_PARSER_FETCH_WORKERS, SIMPLY_PARSER_PARSE_PROCESSES, \
+    SIMPLY_PARSER_PARSE_QUEUE_SIZE, SIMPLY_CACHE_ENABLED, SIMPLY_CACHE_OFFLINE, SIMPLY_CHECKPOINT_PATH, \
+    SIMPLY_QUEUE_BATCH, SIMPLY_QUEUE_POLL_INTERVAL, SimplyConfig
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
@@ -20,317 +37,447 @@ class SimplyGreenTrade:
     Interaction with https://simplygreentrade.com/
     """
 
-    def __init__(self, path: WindowsPath, config: SimplyConfig) -> None:
+    def __init__(self, path: WindowsPath, config: SimplyConfig, offline: bool = SIMPLY_CACHE_OFFLINE,
+                 resume: bool = False, cache: bool = SIMPLY_CACHE_ENABLED,
+                 checkpoint_path: Path = SIMPLY_CHECKPOINT_PATH,
+                 parse_processes: int = SIMPLY_PARSER_PARSE_PROCESSES) -> None:
+        """
+        :param offline: serve pages only from the http cache
+        :param resume: continue the crawl recorded in the checkpoint store instead of starting over
+        :param cache: keep responses in the http cache
+        :param parse_processes: size of the parse process pool, a share of the cpus when several crawl at once
+        """
         self.all_products = None
         self.path = path
         self.config = config
-        self.session = get_session()
-        self.__auth()
+        self.base_url = config.simply_url.rstrip('/')
+        self.auth_url = self.base_url + SIMPLY_PARSER_AUTH_PATH
+        self.ajax_url = self.base_url + SIMPLY_PARSER_AJAX_PATH
+        self.offline = offline
+        self.cache = cache
+        self.parse_processes = parse_processes
+        # the session is opened and authorized on the first request
+        self._session = None
+        self._session_lock = threading.Lock()
         self.catalog_urls = []
-        self.product_urls = []
+        # canonical product link -> categories the product appears in
+        self.product_urls = {}
+        # products and catalogs of this run that could not be parsed,
+        # products missing for this reason must not be deleted from the store
+        self.failed_count = 0
+
+        self.checkpoint = CheckpointStore(checkpoint_path)
+        self.resume = resume
+        if not resume:
+            self.checkpoint.clear()
+        elif listing := self.checkpoint.load_listing():
+            self.catalog_urls, self.product_urls = listing
+            logging.info(f'Resumed listing: {len(self.catalog_urls)} catalogs, {len(self.product_urls)} products')
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        Authorized session, opened on the first use
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = get_session(cache=self.cache, offline=self.offline, cache_exclude=(self.auth_url,))
+                    if self.offline:
+                        logging.info('Offline mode, authorization skipped')
+                    else:
+                        self.__auth(session)
+                    self._session = session
+        return self._session
 
-    def __auth(self):
+    def __auth(self, session: requests.Session):
         """
         Authorization
         """
-        response = self.session.get(SIMPLY_PARSER_AUTH_URL, headers=SIMPLY_PARSER_HEADERS)
-        soup = BeautifulSoup(response.text, 'lxml')
+        with metrics.timer('auth'):
+            response = session.get(self.auth_url, headers=SIMPLY_PARSER_HEADERS)
+            soup = BeautifulSoup(response.text, 'lxml')
 
-        login_nonce = soup.find('input', {'id': 'woocommerce-login-nonce'})['value']
-        data = f'username={self.config.simply_login}&' \
-               f'password={self.config.simply_password}&' \
-               f'woocommerce-login-nonce={login_nonce}&_wp_http_referer=%2Faccount%2F%3Faction%3Dlogin&login=Log+in'
-        response = self.session.post(SIMPLY_PARSER_AUTH_URL, headers=SIMPLY_PARSER_HEADERS, data=data)
+            login_nonce = soup.find('input', {'id': 'woocommerce-login-nonce'})['value']
+            data = f'username={self.config.simply_login}&' \
+                   f'password={self.config.simply_password}&' \
+                   f'woocommerce-login-nonce={login_nonce}&_wp_http_referer=%2Faccount%2F%3Faction%3Dlogin&login=Log+in'
+            response = session.post(self.auth_url, headers=SIMPLY_PARSER_HEADERS, data=data)
 
         if response.status_code != 200:
             raise ValueError("Login or password is incorrect")
         logging.info('Successful authorization')
 
+    @staticmethod
+    def _extract_catalog_urls(html: str) -> list:
+        soup = BeautifulSoup(html, 'lxml')
+        return [x.find('a')['href']
+                for x in soup.find('ul',
+                {'id': 'menu-desktop-horizontal-menu'}).find_all('li',
+                                                                 class_='item-level-0')[:-1]]
+
+    @staticmethod
+    def _extract_pagination(html: str, catalog: str) -> tuple | None:
+        """
+        Finds how a catalog is paginated
+        :return: (page_strip, pages_count) | ('ajax', post_type) | None
+        """
+        soup = BeautifulSoup(html, 'lxml')
+        try:
+            product_count = soup.find('p', class_='woocommerce-result-count').text.strip()
+            product_count = int(product_count.replace('Showing 1–24 of ', '').replace(' results', ''))
+        except:
+            product_count = None
+
+        if product_count:
+            return 'page/', math.ceil(product_count / SIMPLY_PARSER_ITEMS_PER_PAGE)
+        elif 'bestsellers' in catalog:
+            return '?product-page=', int(soup.find('ul', class_='page-numbers').find_all('li')[-2].text)
+        elif 'new' in catalog:
+            return 'ajax', 'product'
+        elif 'product-on-sale' in catalog:
+            return 'ajax', 'sale'
+        return None
+
+    @staticmethod
+    def _extract_listing_urls(html: str) -> list:
+        soup = BeautifulSoup(html, 'lxml')
+        return [x.find('a')['href'] for x in soup.find_all('div', class_='product-element-top')]
+
+    @staticmethod
+    def _extract_ajax_urls(response: dict) -> list | None:
+        """
+        :param response: json of admin-ajax.php
+        :return: product links | None when the feed is over
+        """
+        if response['status'] == 'no-more-posts':
+            return None
+        soup = BeautifulSoup(response['items'], 'lxml')
+        return [x['href'] for x in soup.find_all('a', class_='product-image-link')]
+
     def _get_catalog_urls(self):
         """
         Finds all catalogs links
         """
-        response = self.session.get(SIMPLY_PARSER_BASE_URL)
-        soup = BeautifulSoup(response.text, 'lxml')
-        self.catalog_urls = [x.find('a')['href']
-                             for x in soup.find('ul',
-                             {'id': 'menu-desktop-horizontal-menu'}).find_all('li',
-                                                                              class_='item-level-0')[:-1]]
+        with metrics.timer('catalog_urls'):
+            response = self.session.get(self.base_url)
+            self.catalog_urls = self._extract_catalog_urls(response.text)
+
+    def _add_product_url(self, url: str, catalog: str) -> bool:
+        """
+        Register a product link found in a catalog
+        :return: True if the product was not seen before
+        """
+        url = get_canonical_url(url)
+        category = sys.intern(catalog.split('/')[-2])
+        categories = self.product_urls.get(url)
+        if categories is None:
+            self.product_urls[url] = [category]
+            return True
+        if category not in categories:
+            categories.append(category)
+        return False
+
+    def _fetch_catalog_page(self, url: str) -> str:
+        response = self.session.get(url)
+        response.raise_for_status()
+        return response.text
+
+    def _fetch_listing_page(self, url: str) -> list:
+        with metrics.timer('listing_page', url):
+            response = self.session.get(url)
+            response.raise_for_status()
+            return self._extract_listing_urls(response.text)
+
+    def _fetch_ajax_page(self, post_type: str, page: int) -> list | None:
+        with metrics.timer('listing_page', f'{self.ajax_url}#{post_type}/{page}'):
+            response = self.session.post(self.ajax_url, data=get_ajax_data(post_type, page))
+            response.raise_for_status()
+            return self._extract_ajax_urls(response.json())
+
+    def _get_ajax_product_urls(self, executor: concurrent.futures.Executor, post_type: str) -> list:
+        """
+        Finds product links of an infinite scroll feed. The number of pages is unknown,
+        so SIMPLY_PARSER_AJAX_BATCH pages are requested at once until the first empty one
+        """
+        logging.info('Unable to find products counter')
+        product_urls = []
+        page = 1
+        while True:
+            futures = [executor.submit(self._fetch_ajax_page, post_type, page + i)
+                       for i in range(SIMPLY_PARSER_AJAX_BATCH)]
+            page += SIMPLY_PARSER_AJAX_BATCH
+            for future in futures:
+                cur_product_urls = future.result()
+                if cur_product_urls is None:
+                    for rest in futures:
+                        rest.cancel()
+                    return product_urls
+                product_urls += cur_product_urls
 
     def _get_product_urls(self):
         """
-        Finds all product links
+        Finds all product links. Catalog, listing and feed pages that still fail after
+        the retries are counted in failed_count, the listing is incomplete then
+        """
+        def add_product_urls(cur_product_urls: list, catalog: str):
+            for cur_product_url in cur_product_urls:
+                self._add_product_url(cur_product_url, catalog)
+
+        def listing_failed(url: str, error: Exception):
+            logging.error(f'Unable to fetch {url}: {error}')
+            self.failed_count += 1
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=SIMPLY_PARSER_LISTING_WORKERS) as executor:
+            catalog_pages = [executor.submit(self._fetch_catalog_page, catalog) for catalog in self.catalog_urls]
+
+            listing, ajax_feeds = [], []
+            for catalog, future in zip(self.catalog_urls, catalog_pages):
+                logging.info(f'Start parsing {catalog}')
+                try:
+                    html = future.result()
+                except requests.RequestException as error:
+                    listing_failed(catalog, error)
+                    continue
+                pagination = self._extract_pagination(html, catalog)
+
+                if pagination is None:
+                    continue
+                elif pagination[0] == 'ajax':
+                    ajax_feeds.append((pagination[1], catalog))
+                else:
+                    page_strip, pages_count = pagination
+                    logging.info(f'Total pages: {pages_count}')
+                    listing += [(executor.submit(self._fetch_listing_page, catalog + f'{page_strip}{page}'),
+                                 catalog + f'{page_strip}{page}', catalog)
+                                for page in range(1, pages_count + 1)]
+
+            for future, url, catalog in tqdm(listing):
+                try:
+                    add_product_urls(future.result(), catalog)
+                except requests.RequestException as error:
+                    listing_failed(url, error)
+
+            for post_type, catalog in ajax_feeds:
+                try:
+                    add_product_urls(self._get_ajax_product_urls(executor, post_type), catalog)
+                except requests.RequestException as error:
+                    listing_failed(catalog, error)
+
+    @staticmethod
+    def _extract_details(html: str, url: str, categories: list,
+                         extractor: str = SIMPLY_PARSER_EXTRACTOR) -> Product | None:
+        """
+        Extract product details from the product page
+        :param extractor: soup | lxml, see simply_parser.extractors
+        """
+        return EXTRACTORS[extractor](html, url, categories)
+
+    def get_catalog_urls(self) -> list:
+        """
+        Catalog links, fetched on the first call
         """
-        def parse_per_page(page_strip: str, pages_count: int, catalog: str):
-            logging.info(f'Total pages: {pages_count}')
-            for page in range(1, pages_count+1):
-                url = catalog + f'{page_strip}{page}'
+        if not self.catalog_urls:
+            self._get_catalog_urls()
+            logging.info(f'Total catalogs found: {len(self.catalog_urls)}')
+        return self.catalog_urls
+
+    def _iter_parsed(self, skip: set, extract: Callable = None,
+                     product_urls: Iterator[tuple] = None) -> Iterator[Product | Stock]:
+        """
+        Fetch product pages in threads and parse them in processes.
+        At most SIMPLY_PARSER_PARSE_QUEUE_SIZE products are fetched, parsed
+        or waiting for the consumer at once, a slow consumer holds back both stages
+        :param skip: links of products that are already parsed
+        :param extract: picklable function of (content, encoding, url, categories), extract_details by default
+        :param product_urls: (url, categories) pulled as the stages have room, self.product_urls by default
+        """
+        extract = extract or partial(extract_details, extractor=SIMPLY_PARSER_EXTRACTOR)
+        if product_urls is None:
+            product_urls = ((url, categories) for url, categories in self.product_urls.items() if url not in skip)
+            progress = tqdm(total=len(self.product_urls) - len(skip & self.product_urls.keys()))
+        else:
+            progress = tqdm()
+        # parsing maps futures to product links
+        fetching, parsing = set(), {}
+
+        def fetch(url: str, categories: list) -> tuple:
+            with metrics.timer('product_fetch', url):
                 response = self.session.get(url)
-                soup = BeautifulSoup(response.text, 'lxml')
-                cur_product_urls = [x.find('a')['href'] for x in soup.find_all('div', class_='product-element-top')]
-                for cur_product_url in cur_product_urls:
-                    if cur_product_url not in self.product_urls:
-                        self.product_urls.append([cur_product_url, catalog])
-
-        for catalog in tqdm(self.catalog_urls):
-            logging.info(f'Start parsing {catalog}')
-            response = self.session.get(catalog)
-            soup = BeautifulSoup(response.text, 'lxml')
+            return response.content, response.encoding, url, categories
 
-            try:
-                product_count = soup.find('p', class_='woocommerce-result-count').text.strip()
-                product_count = int(product_count.replace('Showing 1–24 of ', '').replace(' results', ''))
-            except:
-                product_count = None
-
-            if product_count:
-                pages_count = math.ceil(product_count / SIMPLY_PARSER_ITEMS_PER_PAGE)
-                page_strip = 'page/'
-                parse_per_page(page_strip, pages_count, catalog)
-            elif 'bestsellers' in catalog:
-                pages_count = int(soup.find('ul', class_='page-numbers').find_all('li')[-2].text)
-                page_strip = '?product-page='
-                parse_per_page(page_strip, pages_count, catalog)
-            elif 'new' in catalog:
-                logging.info('Unable to find products counter')
-                page = 0
-                while True:
-                    page += 1
-                    data = {
-                        'atts[element_title]': '',
-                        'atts[post_type]': 'product',
-                        'atts[layout]': 'grid',
-                        'atts[include]': '',
-                        'atts[custom_query]': '',
-                        'atts[taxonomies]': '',
-                        'atts[pagination]': 'infinit',
-                        'atts[items_per_page]': '25',
-                        'atts[product_hover]': 'standard',
-                        'atts[spacing]': '20',
-                        'atts[columns]': '5',
-                        'atts[columns_tablet]': '3',
-                        'atts[columns_mobile]': '2',
-                        'atts[sale_countdown]': '0',
-                        'atts[stretch_product_desktop]': '0',
-                        'atts[stretch_product_tablet]': '0',
-                        'atts[stretch_product_mobile]': '0',
-                        'atts[stock_progress_bar]': '0',
-                        'atts[highlighted_products]': '0',
-                        'atts[products_bordered_grid]': '0',
-                        'atts[products_bordered_grid_style]': 'outside',
-                        'atts[products_with_background]': '0',
-                        'atts[products_shadow]': '0',
-                        'atts[products_color_scheme]': 'default',
-                        'atts[product_quantity]': '0',
-                        'atts[grid_gallery]': '',
-                        'atts[grid_gallery_control]': '',
-                        'atts[grid_gallery_enable_arrows]': '',
-                        'atts[offset]': '',
-                        'atts[orderby]': 'date',
-                        'atts[query_type]': 'OR',
-                        'atts[order]': 'DESC',
-                        'atts[meta_key]': '',
-                        'atts[exclude]': '',
-                        'atts[class]': '',
-                        'atts[ajax_page]': '',
-                        'atts[speed]': '5000',
-                        'atts[slides_per_view]': '4',
-                        'atts[slides_per_view_tablet]': 'auto',
-                        'atts[slides_per_view_mobile]': 'auto',
-                        'atts[wrap]': '',
-                        'atts[autoplay]': 'no',
-                        'atts[center_mode]': 'no',
-                        'atts[hide_pagination_control]': '',
-                        'atts[hide_prev_next_buttons]': '',
-                        'atts[scroll_per_page]': 'yes',
-                        'atts[img_size]': 'woocommerce_thumbnail',
-                        'atts[force_not_ajax]': 'no',
-                        'atts[products_masonry]': '0',
-                        'atts[products_different_sizes]': '0',
-                        'atts[lazy_loading]': 'yes',
-                        'atts[scroll_carousel_init]': 'no',
-                        'atts[el_class]': '',
-                        'atts[shop_tools]': 'no',
-                        'atts[query_post_type]': 'product',
-                        'atts[hide_out_of_stock]': 'no',
-                        'atts[css]': '',
-                        'atts[woodmart_css_id]': '6460f6a67ace8',
-                        'atts[ajax_recently_viewed]': 'no',
-                        'atts[is_wishlist]': '',
-                        'paged': page,
-                        'action': 'woodmart_get_products_shortcode',
-                        'woo_ajax': '1',
-                    }
-                    response = self.session.post('https://simplygreentrade.com/wp-admin/admin-ajax.php', data=data)
-                    if response.json()['status'] == 'no-more-posts':
-                        print(page)
-                        break
-                    soup = BeautifulSoup(response.json()['items'], 'lxml')
-                    cur_product_urls = [x['href'] for x in soup.find_all('a', class_='product-image-link')]
-                    for cur_product_url in cur_product_urls:
-                        if cur_product_url not in self.product_urls:
-                            self.product_urls.append([cur_product_url, catalog])
-
-            elif 'product-on-sale' in catalog:
-                logging.info('Unable to find products counter')
-                page = 0
-                while True:
-                    page += 1
-                    data = {
-                        'atts[element_title]': '',
-                        'atts[post_type]': 'sale',
-                        'atts[layout]': 'grid',
-                        'atts[include]': '',
-                        'atts[custom_query]': '',
-                        'atts[taxonomies]': '',
-                        'atts[pagination]': 'infinit',
-                        'atts[items_per_page]': '25',
-                        'atts[product_hover]': 'standard',
-                        'atts[spacing]': '20',
-                        'atts[columns]': '5',
-                        'atts[columns_tablet]': '3',
-                        'atts[columns_mobile]': '2',
-                        'atts[sale_countdown]': '0',
-                        'atts[stretch_product_desktop]': '0',
-                        'atts[stretch_product_tablet]': '0',
-                        'atts[stretch_product_mobile]': '0',
-                        'atts[stock_progress_bar]': '0',
-                        'atts[highlighted_products]': '0',
-                        'atts[products_bordered_grid]': '0',
-                        'atts[products_bordered_grid_style]': 'outside',
-                        'atts[products_with_background]': '0',
-                        'atts[products_shadow]': '0',
-                        'atts[products_color_scheme]': 'default',
-                        'atts[product_quantity]': '0',
-                        'atts[grid_gallery]': '',
-                        'atts[grid_gallery_control]': '',
-                        'atts[grid_gallery_enable_arrows]': '',
-                        'atts[offset]': '',
-                        'atts[orderby]': 'date',
-                        'atts[query_type]': 'OR',
-                        'atts[order]': 'DESC',
-                        'atts[meta_key]': '',
-                        'atts[exclude]': '',
-                        'atts[class]': '',
-                        'atts[ajax_page]': '',
-                        'atts[speed]': '5000',
-                        'atts[slides_per_view]': '4',
-                        'atts[slides_per_view_tablet]': 'auto',
-                        'atts[slides_per_view_mobile]': 'auto',
-                        'atts[wrap]': '',
-                        'atts[autoplay]': 'no',
-                        'atts[center_mode]': 'no',
-                        'atts[hide_pagination_control]': '',
-                        'atts[hide_prev_next_buttons]': '',
-                        'atts[scroll_per_page]': 'yes',
-                        'atts[img_size]': 'woocommerce_thumbnail',
-                        'atts[force_not_ajax]': 'no',
-                        'atts[products_masonry]': '0',
-                        'atts[products_different_sizes]': '0',
-                        'atts[lazy_loading]': 'yes',
-                        'atts[scroll_carousel_init]': 'no',
-                        'atts[el_class]': '',
-                        'atts[shop_tools]': 'no',
-                        'atts[query_post_type]': 'product',
-                        'atts[hide_out_of_stock]': 'no',
-                        'atts[css]': '',
-                        'atts[woodmart_css_id]': '6460f6a67ace8',
-                        'atts[ajax_recently_viewed]': 'no',
-                        'atts[is_wishlist]': '',
-                        'paged': page,
-                        'action': 'woodmart_get_products_shortcode',
-                        'woo_ajax': '1',
-                    }
-                    response = self.session.post('https://simplygreentrade.com/wp-admin/admin-ajax.php', data=data)
-                    if response.json()['status'] == 'no-more-posts':
-                        print(page)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=SIMPLY_PARSER_FETCH_WORKERS) as fetcher, \
+                concurrent.futures.ProcessPoolExecutor(max_workers=self.parse_processes,
+                                                       mp_context=multiprocessing.get_context('spawn')) as parser:
+            while True:
+                while len(fetching) + len(parsing) < SIMPLY_PARSER_PARSE_QUEUE_SIZE:
+                    product_url = next(product_urls, None)
+                    if product_url is None:
                         break
-                    soup = BeautifulSoup(response.json()['items'], 'lxml')
-                    cur_product_urls = [x['href'] for x in soup.find_all('a', class_='product-image-link')]
-                    for cur_product_url in cur_product_urls:
-                        if cur_product_url not in self.product_urls:
-                            self.product_urls.append([cur_product_url, catalog])
-            else:
-                pass
+                    fetching.add(fetcher.submit(fetch, *product_url))
+                if not fetching and not parsing:
+                    break
+
+                done, _ = concurrent.futures.wait(fetching | parsing.keys(),
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if future in fetching:
+                        fetching.remove(future)
+                        try:
+                            page = future.result()
+                        except requests.RequestException:
+                            logging.exception('Unable to fetch product')
+                            progress.update()
+                            self.failed_count += 1
+                            continue
+                        parsing[parser.submit(call_timed, extract, *page)] = page[2]
+                        continue
+
+                    url = parsing.pop(future)
+                    progress.update()
+                    try:
+                        cur_product, seconds = future.result()
+                    except Exception:
+                        logging.exception('Unable to parse product')
+                        self.failed_count += 1
+                        continue
+                    metrics.observe('product_parse', seconds, url)
+                    if cur_product:
+                        yield cur_product
+                    else:
+                        self.failed_count += 1
+        progress.close()
+
+    def _iter_new_products(self, engine: str, skip: set) -> Iterator[Product]:
+        if engine == 'async' and self.offline:
+            logging.warning('The async engine does not read the http cache, threads engine is used offline')
+        elif engine == 'async':
+            from simply_parser.crawler import AsyncCrawler
 
-    def _parse_details(self, url: str, category: str) -> dict | None:
+            yield from AsyncCrawler(self, skip=skip).iter_products()
+            return
+
+        if not self.product_urls:
+            self.get_catalog_urls()
+            self._get_product_urls()
+            # an incomplete listing is not recorded, a resumed crawl lists the catalogs again
+            if not self.failed_count:
+                self.checkpoint.save_listing(self.catalog_urls, self.product_urls)
+        logging.info(f'Total products found: {len(self.product_urls)}')
+
+        yield from self._iter_parsed(skip)
+
+    def iter_products(self, engine: str = SIMPLY_PARSER_ENGINE) -> Iterator[Product]:
+        """
+        Parse the whole catalog, products are yielded as soon as they are parsed
+        and recorded in the checkpoint store. On resume the recorded products
+        are yielded first and their pages are not fetched again.
+        With the async engine the categories of a product can still grow after it
+        is yielded, if it shows up in a catalog that is crawled later
+        :param engine: threads | async
         """
+        parsed_urls = set()
+        for product in self.checkpoint.iter_products():
+            parsed_urls.add(product.url)
+            yield product
+        if parsed_urls:
+            logging.info(f'Resumed products: {len(parsed_urls)}')
 
-        Parse product details
-        :param url: current link
-        :return: dict of details | None
+        products_count = len(parsed_urls)
+        for product in self._iter_new_products(engine, parsed_urls):
+            self.checkpoint.save_product(product)
+            products_count += 1
+            yield product
+        logging.info(f'Total products parsed {products_count}')
+        if self.failed_count:
+            logging.error(f'Unable to parse {self.failed_count} products or catalogs')
+        self.checkpoint.save_failed(self.failed_count)
+        if self._session is not None:
+            log_pool_stats(self._session)
+
+    def iter_stock(self) -> Iterator[Stock]:
         """
-        response = self.session.get(url)
-        soup = BeautifulSoup(response.text, 'lxml')
+        Read only price and stock of every product, for a refresh of the store.
+        Product links come from the listing, unless product_urls is already filled.
+        Nothing is recorded in the checkpoint store
+        """
+        if not self.product_urls:
+            self.get_catalog_urls()
+            self._get_product_urls()
+        logging.info(f'Total products found: {len(self.product_urls)}')
 
-        name = soup.find('h1', class_='product_title').text.strip()
-        try:
-            brand = soup.find('tr',
-                              class_='woocommerce-product-attributes-'
-                                     'item--attribute_pa_brand').find('td',
-                                                                      class_='woocommerce-product-'
-                                                                             'attributes-item__value').text.strip()
-        except:
-            brand = name.split(' ')[0]
+        stock_count = 0
+        for stock in self._iter_parsed(set(), extract_stock):
+            stock_count += 1
+            yield stock
+        logging.info(f'Total products refreshed {stock_count}')
+        if self._session is not None:
+            log_pool_stats(self._session)
 
-        try:
-            description = soup.find('div', class_='wd-single-content').extract()
-            if description.find('h2'):
-                description.find('h2').extract()
-            description = description.text.strip()
-        except:
-            description = None
-
-        breadcrumbs = [x.text.strip() for x in soup.find('nav', class_='woocommerce-breadcrumb').find_all('a', 'breadcrumb-link')[1:]]
-        artcile = soup.find('div', class_='sku-single').text.strip()
-        price = float(soup.find('p', class_='price').find('span', class_='woocommerce-Price-amount').text.strip().replace('.', '').replace(',', '.').replace('€', ''))
-        image = soup.find('figure', class_='woocommerce-product-gallery__image').find('a')['href']
-
-        is_available_text = soup.find('div', class_='detailed-info-stock').find('div', class_='wpb_wrapper').text.strip()
-        if is_available_text == 'Available' or is_available_text == 'Limited stock':
-            is_available = True
-        elif is_available_text == 'Sold out' or is_available_text == 'Out of stock':
-            is_available = False
-        else:
-            logging.error(f'%%%%%%%%%%%%%NEW AVAILABLE STATUS%%%%%%%%%%%%%%%%%%%{is_available_text}')
-            return None
+    def enqueue_products(self, queue: WorkQueue) -> None:
+        """
+        Find all product links and shard them into the work queue of a sharded crawl
+        """
+        if not self.product_urls:
+            self.get_catalog_urls()
+            self._get_product_urls()
+        queue.enqueue(self.product_urls)
+        logging.info(f'Total products queued: {len(self.product_urls)}')
 
-        if is_available:
-            in_stock = soup.find('div', class_='quantity').find('input', class_='input-text')['max']
-        else:
-            in_stock = 0
-
-        features = [{x.find('th').text.strip(): x.find('td').text.strip()}
-                    for x in soup.find('table', class_='woocommerce-product-attributes').find_all('tr')]
-
-        return {
-            'url': url,
-            'article': artcile,
-            'name': name,
-            'brand': brand,
-            'image': image,
-            'price': price,
-            'is_available': is_available,
-            'in_stock': in_stock,
-            'breadcrumbs': breadcrumbs,
-            'description': description,
-            'features': features,
-            'category': category
-        }
-
-    def parse_catalog(self):
-        self._get_catalog_urls()
-        logging.info(f'Total catalogs found: {len(self.catalog_urls)}')
-        self._get_product_urls()
-        logging.info(f'Total products found: {len(self.product_urls)}')
+    def work(self, queue: WorkQueue, worker: str = None) -> int:
+        """
+        Claim batches of product links from the work queue and write the parsed products back,
+        until no link is pending or claimed by another worker
+        :param worker: name of the worker in the queue, host and pid by default
+        :return: number of products parsed by this worker
+        """
+        worker = worker or f'{socket.gethostname()}-{os.getpid()}'
+        products_count = 0
+        while True:
+            claimed = set()
+
+            def iter_claimed() -> Iterator[tuple]:
+                while batch := queue.claim(worker, SIMPLY_QUEUE_BATCH):
+                    claimed.update(url for url, _ in batch)
+                    yield from batch
+
+            for product in self._iter_parsed(set(), product_urls=iter_claimed()):
+                queue.complete(product)
+                claimed.discard(product.url)
+                products_count += 1
+            if claimed:
+                logging.error(f'Unable to parse {len(claimed)} products, released to the queue')
+                queue.release(claimed)
+
+            if requeued := queue.requeue_stale():
+                logging.info(f'Requeued {requeued} products of stopped workers')
+            counts = queue.counts()
+            if not counts.get(PENDING) and not counts.get(CLAIMED):
+                break
+            if not counts.get(PENDING):
+                # the rest is claimed by other workers, wait for them to finish or to go stale
+                time.sleep(SIMPLY_QUEUE_POLL_INTERVAL)
+
+        logging.info(f'Worker {worker} parsed {products_count} products')
+        if self._session is not None:
+            log_pool_stats(self._session)
+        return products_count
+
+    def parse_catalog(self, engine: str = SIMPLY_PARSER_ENGINE):
+        """
+        Parse the whole catalog into self.all_products
+        :param engine: threads | async
+        """
+        self.all_products = list(self.iter_products(engine))
 
-        all_products = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            futures = [executor.submit(self._parse_details, product_url[0], product_url[1].split('/')[-2]) for product_url in self.product_urls]
-            for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
-                cur_product = future.result()
-                if cur_product:
-                    all_products.append(cur_product)
 
-        logging.info(f'Total products parsed {len(all_products)}')
-        self.all_products = all_products
+def run_worker(path: Path, config: SimplyConfig, queue_path: Path,
+               parse_processes: int = SIMPLY_PARSER_PARSE_PROCESSES) -> int:
+    """
+    Entry point of a worker process of a sharded crawl, authorizes once and works the queue
+    :param parse_processes: all the cpus on a machine of its own, a share of them next to other workers
+    """
+    # resume keeps the checkpoint of the coordinator, workers do not write to it.
+    # The http cache is left out, its index is not shared between processes
+    return SimplyGreenTrade(path, config, resume=True, cache=False,
+                            parse_processes=parse_processes).work(WorkQueue(queue_path))
@@ -0,0 +1,58 @@
+import sys
+from dataclasses import dataclass, asdict
+
+
+@dataclass(slots=True)
+class Product:
+    """
+    Parsed product. Strings repeated across the catalog are interned and
+    features are flat (key, value) pairs
+    """
+    url: str
+    article: str
+    name: str
+    brand: str
+    image: str
+    price: float
+    is_available: bool
+    in_stock: int | str
+    breadcrumbs: tuple
+    description: str | None
+    features: tuple
+    # the list of the url index of SimplyGreenTrade when parsed in the same process,
+    # a copy when it comes from a parse process
+    categories: list
+
+    def __post_init__(self) -> None:
+        self.brand = sys.intern(self.brand)
+        self.breadcrumbs = tuple(sys.intern(breadcrumb) for breadcrumb in self.breadcrumbs)
+        self.features = tuple((sys.intern(key), value) for key, value in self.features)
+
+    def __setstate__(self, state: tuple) -> None:
+        """
+        Products of the parse processes come back by pickle, which skips __post_init__,
+        the strings are interned again in the receiving process
+        """
+        for name, value in state[1].items():
+            setattr(self, name, value)
+        self.__post_init__()
+        self.categories = [sys.intern(category) for category in self.categories]
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Product':
+        return cls(**{**data, 'features': [tuple(feature) for feature in data['features']]})
+
+
+@dataclass(slots=True)
+class Stock:
+    """
+    Price and stock of a product, what a refresh reads from the product page
+    """
+    url: str
+    article: str
+    price: float
+    is_available: bool
+    in_stock: int | str
@@ -0,0 +1,191 @@
+"""
+Compact catalog snapshot.
+
+Layout, little-endian:
+    header      MAGIC, counts and offsets of the sections
+    strings     u32 offsets (count + 1) followed by utf-8 data, every string stored once
+    records     one fixed size record per product, strings are indexes in the string table
+    refs        u32 string indexes: breadcrumbs, then feature key/value pairs, then categories of each product
+
+Snapshot maps the file and decodes a product only when it is accessed,
+so opening a snapshot does not depend on the number of products.
+"""
+import mmap
+import os
+import struct
+from array import array
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from simply_parser.product import Product
+
+MAGIC = b'SGTSNAP1'
+HEADER = struct.Struct('<8sIIIQQQQ')
+# url, article, name, brand, image, description, in_stock, price, flags,
+# refs start, breadcrumbs count, features count, categories count
+RECORD = struct.Struct('<7IdB4I')
+NONE = 0xFFFFFFFF
+
+FLAG_AVAILABLE = 1
+FLAG_IN_STOCK_INT = 2
+
+
+class SnapshotWriter:
+    """
+    Collects products into the snapshot format, the file is written on close.
+    Used as a context manager nothing is written if the block fails
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.strings = {}
+        self.records = bytearray()
+        self.refs = array('I')
+        self.count = 0
+
+    def _ref(self, value: str | None) -> int:
+        if value is None:
+            return NONE
+        ref = self.strings.get(value)
+        if ref is None:
+            ref = self.strings[value] = len(self.strings)
+        return ref
+
+    def add(self, product: Product) -> None:
+        flags = (FLAG_AVAILABLE if product.is_available else 0) | \
+                (FLAG_IN_STOCK_INT if isinstance(product.in_stock, int) else 0)
+
+        self.records += RECORD.pack(
+            self._ref(product.url), self._ref(product.article), self._ref(product.name),
+            self._ref(product.brand), self._ref(product.image), self._ref(product.description),
+            self._ref(str(product.in_stock)), product.price, flags, len(self.refs),
+            len(product.breadcrumbs), len(product.features), len(product.categories)
+        )
+        self.refs.extend(self._ref(breadcrumb) for breadcrumb in product.breadcrumbs)
+        for key, value in product.features:
+            self.refs.extend((self._ref(key), self._ref(value)))
+        self.refs.extend(self._ref(category) for category in product.categories)
+        self.count += 1
+
+    def tee(self, products: Iterable[Product]) -> Iterator[Product]:
+        """
+        Add products while passing them on
+        """
+        for product in products:
+            self.add(product)
+            yield product
+
+    def close(self) -> None:
+        data = bytearray()
+        offsets = array('I', [0])
+        for value in self.strings:
+            data += value.encode('utf-8')
+            offsets.append(len(data))
+        if offsets.itemsize != 4 or struct.pack('=I', 1) != struct.pack('<I', 1):
+            raise RuntimeError('Snapshot needs a little-endian platform with 4 byte unsigned int')
+
+        strings_offset = HEADER.size
+        records_offset = strings_offset + len(offsets) * 4 + len(data)
+        refs_offset = records_offset + len(self.records)
+
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, self.count, len(self.strings), len(self.refs),
+                                   strings_offset, records_offset, refs_offset, 0))
+            file.write(offsets.tobytes())
+            file.write(data)
+            file.write(self.records)
+            file.write(self.refs.tobytes())
+        os.replace(tmp_path, self.path)
+
+    def __enter__(self) -> 'SnapshotWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+
+
+def write_snapshot(path: Path, products: Iterable[Product]) -> int:
+    """
+    :return: number of written products
+    """
+    with SnapshotWriter(path) as writer:
+        for product in products:
+            writer.add(product)
+    return writer.count
+
+
+class Snapshot:
+    """
+    Read-only memory-mapped view of a snapshot file
+    """
+
+    def __init__(self, path: Path) -> None:
+        with open(path, 'rb') as file:
+            self.mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, strings_count, refs_count, strings_offset, records_offset, refs_offset, _ = \
+            HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a catalog snapshot')
+
+        view = memoryview(self.mm)
+        self._offsets = view[strings_offset:strings_offset + (strings_count + 1) * 4].cast('I')
+        self._data_offset = strings_offset + (strings_count + 1) * 4
+        self._records_offset = records_offset
+        self._refs = view[refs_offset:refs_offset + refs_count * 4].cast('I')
+        self._strings = {}
+
+    def string(self, ref: int) -> str | None:
+        if ref == NONE:
+            return None
+        value = self._strings.get(ref)
+        if value is None:
+            start = self._data_offset + self._offsets[ref]
+            end = self._data_offset + self._offsets[ref + 1]
+            value = self._strings[ref] = self.mm[start:end].decode('utf-8')
+        return value
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> Product:
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        url, article, name, brand, image, description, in_stock, price, flags, \
+            refs_start, breadcrumbs_count, features_count, categories_count = \
+            RECORD.unpack_from(self.mm, self._records_offset + index * RECORD.size)
+
+        refs = self._refs[refs_start:refs_start + breadcrumbs_count + 2 * features_count + categories_count]
+        features = refs[breadcrumbs_count:breadcrumbs_count + 2 * features_count]
+        in_stock = self.string(in_stock)
+        return Product(
+            url=self.string(url),
+            article=self.string(article),
+            name=self.string(name),
+            brand=self.string(brand),
+            image=self.string(image),
+            price=price,
+            is_available=bool(flags & FLAG_AVAILABLE),
+            in_stock=int(in_stock) if flags & FLAG_IN_STOCK_INT else in_stock,
+            breadcrumbs=tuple(self.string(ref) for ref in refs[:breadcrumbs_count]),
+            description=self.string(description),
+            features=tuple((self.string(features[i]), self.string(features[i + 1]))
+                           for i in range(0, len(features), 2)),
+            categories=[self.string(ref) for ref in refs[breadcrumbs_count + 2 * features_count:]]
+        )
+
+    def __iter__(self) -> Iterator[Product]:
+        for index in range(self.count):
+            yield self[index]
+
+    def close(self) -> None:
+        self._offsets.release()
+        self._refs.release()
+        self.mm.close()
+
+    def __enter__(self) -> 'Snapshot':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
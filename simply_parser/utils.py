@@ -1,22 +1,114 @@
+import logging
+import socket
+from urllib.parse import urlsplit, urlunsplit
+
 import requests
-from requests.adapters import HTTPAdapter
 from urllib3 import Retry
+from urllib3.connection import HTTPConnection
 
-from config import SIMPLY_UTILS_MAX_RETRY_FOR_SESSION, SIMPLY_UTILS_BACK_OFF_FACTOR, SIMPLY_UTILS_ERROR_CODES
+from simply_parser.cache import HTTPCache, CachingHTTPAdapter
+from simply_parser.limiter import AdaptiveLimiter, AdaptiveHTTPAdapter
+from simply_parser.metrics import metrics
+from config import SIMPLY_UTILS_MAX_RETRY_FOR_SESSION, SIMPLY_UTILS_BACK_OFF_FACTOR, SIMPLY_UTILS_ERROR_CODES, \
+    SIMPLY_PARSER_AJAX_DATA, SIMPLY_CACHE_ENABLED, SIMPLY_CACHE_OFFLINE, SIMPLY_CACHE_PATH, SIMPLY_CACHE_TTL, \
+    SIMPLY_CACHE_MAX_SIZE, SIMPLY_CACHE_EXCLUDE, SIMPLY_LIMITER_ENABLED, SIMPLY_LIMITER_INITIAL, SIMPLY_LIMITER_MAX, \
+    SIMPLY_POOL_MAXSIZE, SIMPLY_POOL_TCP_KEEPALIVE
 
 
 def get_session(
         retries: int = SIMPLY_UTILS_MAX_RETRY_FOR_SESSION,
         back_off_factor: int = SIMPLY_UTILS_BACK_OFF_FACTOR,
-        status_force_list: list = SIMPLY_UTILS_ERROR_CODES
+        status_force_list: list = SIMPLY_UTILS_ERROR_CODES,
+        cache: bool = SIMPLY_CACHE_ENABLED,
+        offline: bool = SIMPLY_CACHE_OFFLINE,
+        adaptive: bool = SIMPLY_LIMITER_ENABLED,
+        pool_maxsize: int = SIMPLY_POOL_MAXSIZE,
+        cache_exclude: tuple = SIMPLY_CACHE_EXCLUDE
 ) -> requests.Session:
+    """
+    Session with retries. With cache responses are kept on disk and revalidated,
+    offline serves only cached responses. With adaptive the requests in flight
+    are limited by an AdaptiveLimiter, which also takes over the retries
+    :param pool_maxsize: connections kept alive per host
+    :param cache_exclude: urls that are never cached
+    """
     session = requests.Session()
-    retry = Retry(total=retries,
-                  read=retries,
-                  connect=retries,
-                  backoff_factor=back_off_factor,
-                  status_forcelist=status_force_list,
-                  allowed_methods=frozenset(['GET', 'POST']))
-    adapter = HTTPAdapter(max_retries=retry)
+    if adaptive:
+        limiter = AdaptiveLimiter(SIMPLY_LIMITER_INITIAL, SIMPLY_LIMITER_MAX, name='shop', retries=retries,
+                                  back_off_factor=back_off_factor, status_force_list=status_force_list)
+        retry = 0
+    else:
+        limiter = None
+        retry = Retry(total=retries,
+                      read=retries,
+                      connect=retries,
+                      backoff_factor=back_off_factor,
+                      status_forcelist=status_force_list,
+                      allowed_methods=frozenset(['GET', 'POST']))
+    if cache or offline:
+        adapter = CachingHTTPAdapter(HTTPCache(SIMPLY_CACHE_PATH, SIMPLY_CACHE_TTL, SIMPLY_CACHE_MAX_SIZE),
+                                     offline=offline, exclude=cache_exclude, limiter=limiter,
+                                     socket_options=get_socket_options(), pool_maxsize=pool_maxsize,
+                                     max_retries=retry)
+    else:
+        adapter = AdaptiveHTTPAdapter(limiter=limiter, socket_options=get_socket_options(),
+                                      pool_maxsize=pool_maxsize, max_retries=retry)
     session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.hooks['response'].append(metrics.response_hook('shop'))
     return session
+
+
+def get_socket_options(keepalive: bool = SIMPLY_POOL_TCP_KEEPALIVE) -> list | None:
+    """
+    Socket options of pooled connections, with keepalive idle connections
+    are probed instead of being dropped silently by the network
+    """
+    if not keepalive:
+        return None
+    return HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+
+def get_pool_stats(session: requests.Session) -> dict:
+    """
+    Usage of the connection pools of a session
+    :return: dict of pool url -> {'connections': opened, 'requests': sent, 'idle': kept alive}
+    """
+    stats = {}
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats[f'{pool.scheme}://{pool.host}:{pool.port}'] = {
+                'connections': pool.num_connections,
+                'requests': pool.num_requests,
+                # the pool queue is filled with None placeholders up to pool_maxsize
+                'idle': sum(connection is not None for connection in list(pool.pool.queue)) if pool.pool else 0,
+            }
+    return stats
+
+
+def log_pool_stats(session: requests.Session) -> None:
+    for pool, stats in get_pool_stats(session).items():
+        logging.info(f'{pool}: {stats["requests"]} requests over {stats["connections"]} connections, '
+                     f'{stats["idle"]} idle')
+
+
+def get_ajax_data(post_type: str, page: int) -> dict:
+    """
+    Form data of one page of an infinite scroll feed
+    :param post_type: product | sale
+    :param page: page number starting from 1
+    """
+    return {**SIMPLY_PARSER_AJAX_DATA, 'atts[post_type]': post_type, 'paged': page}
+
+
+def get_canonical_url(url: str) -> str:
+    """
+    Product link without query, fragment and case differences in the host
+    """
+    parts = urlsplit(url)
+    path = parts.path if parts.path.endswith('/') else parts.path + '/'
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, '', ''))
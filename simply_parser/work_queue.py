@@ -0,0 +1,112 @@
+import json
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from simply_parser.product import Product
+from config import SIMPLY_QUEUE_STALE_TIMEOUT, SIMPLY_QUEUE_MAX_ATTEMPTS, SIMPLY_QUEUE_LOCK_TIMEOUT
+
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class WorkQueue:
+    """
+    Product links of a sharded crawl in sqlite, shared by the worker processes.
+    Workers claim batches of links and write the parsed products back,
+    links claimed by a worker that died are given out again after SIMPLY_QUEUE_STALE_TIMEOUT
+    """
+
+    def __init__(self, path: Path, max_attempts: int = SIMPLY_QUEUE_MAX_ATTEMPTS) -> None:
+        """
+        :param max_attempts: claims of a link before it is marked as failed
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=SIMPLY_QUEUE_LOCK_TIMEOUT, check_same_thread=False)
+        # rollback journal, WAL works only for connections on one host and the file may be on a share
+        self.db.execute('PRAGMA journal_mode=DELETE')
+        self.db.execute('CREATE TABLE IF NOT EXISTS tasks (url TEXT PRIMARY KEY, categories TEXT, '
+                        'state TEXT, worker TEXT, claimed_at REAL, attempts INTEGER DEFAULT 0)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS products (url TEXT PRIMARY KEY, product TEXT)')
+        self.db.commit()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.db.execute('DELETE FROM tasks')
+            self.db.execute('DELETE FROM products')
+            self.db.commit()
+
+    def enqueue(self, product_urls: dict) -> None:
+        """
+        Add product links, links that are already queued keep their state
+        :param product_urls: product link -> categories
+        """
+        with self.lock:
+            self.db.executemany(f"INSERT OR IGNORE INTO tasks (url, categories, state) VALUES (?, ?, '{PENDING}')",
+                                ((url, json.dumps(categories)) for url, categories in product_urls.items()))
+            self.db.commit()
+
+    def claim(self, worker: str, count: int) -> list:
+        """
+        Take up to count pending links, atomic between processes
+        :return: [(url, categories)]
+        """
+        with self.lock:
+            rows = self.db.execute(
+                f"UPDATE tasks SET state = '{CLAIMED}', worker = ?, claimed_at = ?, attempts = attempts + 1 "
+                f"WHERE url IN (SELECT url FROM tasks WHERE state = '{PENDING}' LIMIT ?) "
+                f"RETURNING url, categories", (worker, time.time(), count)).fetchall()
+            self.db.commit()
+        return [(url, [sys.intern(category) for category in json.loads(categories)]) for url, categories in rows]
+
+    def complete(self, product: Product) -> None:
+        """
+        Record a parsed product and mark its link as done
+        """
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO products VALUES (?, ?)',
+                            (product.url, json.dumps(product.to_dict(), ensure_ascii=False)))
+            self.db.execute(f"UPDATE tasks SET state = '{DONE}' WHERE url = ?", (product.url,))
+            self.db.commit()
+
+    def _requeue(self, condition: str, params: Iterable) -> int:
+        cursor = self.db.executemany(
+            f"UPDATE tasks SET state = CASE WHEN attempts >= ? THEN '{FAILED}' ELSE '{PENDING}' END, worker = NULL "
+            f"WHERE state = '{CLAIMED}' AND {condition}", ((self.max_attempts, *param) for param in params))
+        self.db.commit()
+        return cursor.rowcount
+
+    def release(self, urls: Iterable[str]) -> None:
+        """
+        Give back links a worker was unable to parse, they are pending again until max_attempts
+        """
+        with self.lock:
+            self._requeue('url = ?', ((url,) for url in urls))
+
+    def requeue_stale(self, timeout: float = SIMPLY_QUEUE_STALE_TIMEOUT) -> int:
+        """
+        Give out again the links claimed more than timeout seconds ago
+        :return: number of requeued links
+        """
+        with self.lock:
+            return self._requeue('claimed_at < ?', [(time.time() - timeout,)])
+
+    def counts(self) -> dict:
+        """
+        :return: state -> number of links
+        """
+        with self.lock:
+            return dict(self.db.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state'))
+
+    def iter_products(self) -> Iterator[Product]:
+        cursor = self.db.cursor()
+        for row in cursor.execute('SELECT product FROM products'):
+            yield Product.from_dict(json.loads(row[0]))
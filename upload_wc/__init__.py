@@ -1 +1,9 @@
-from .driver import WooCommerceDriver
+import importlib
+
+__all__ = ['WooCommerceDriver']
+
+
+def __getattr__(name: str):
+    if name != 'WooCommerceDriver':
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    return importlib.import_module('.driver', __name__).WooCommerceDriver
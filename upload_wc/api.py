@@ -0,0 +1,59 @@
+from json import dumps as jsonencode
+from urllib.parse import urlencode
+
+import requests
+from requests.auth import HTTPBasicAuth
+from woocommerce import API
+
+
+class SessionAPI(API):
+    """
+    woocommerce.API sending through one requests.Session.
+    API calls requests.request, which opens a new connection for every call
+    """
+
+    def __init__(self, url: str, consumer_key: str, consumer_secret: str, session: requests.Session,
+                 **kwargs) -> None:
+        super().__init__(url, consumer_key, consumer_secret, **kwargs)
+        self.session = session
+
+    def _API__request(self, method: str, endpoint: str, data, params: dict = None, **kwargs) -> requests.Response:
+        # same as API.__request of woocommerce 3.0.0 except the session
+        if params is None:
+            params = {}
+        # per call timeout, e.g. longer for batch writes
+        timeout = kwargs.pop('timeout', self.timeout)
+        url = self._API__get_url(endpoint)
+        auth = None
+        headers = {
+            'user-agent': f'{self.user_agent}',
+            'accept': 'application/json'
+        }
+
+        if self.is_ssl is True and self.query_string_auth is False:
+            auth = HTTPBasicAuth(self.consumer_key, self.consumer_secret)
+        elif self.is_ssl is True and self.query_string_auth is True:
+            params.update({
+                'consumer_key': self.consumer_key,
+                'consumer_secret': self.consumer_secret
+            })
+        else:
+            encoded_params = urlencode(params)
+            url = f'{url}?{encoded_params}'
+            url = self._API__get_oauth_url(url, method, **kwargs)
+
+        if data is not None:
+            data = jsonencode(data, ensure_ascii=False).encode('utf-8')
+            headers['content-type'] = 'application/json;charset=utf-8'
+
+        return self.session.request(
+            method=method,
+            url=url,
+            verify=self.verify_ssl,
+            auth=auth,
+            params=params,
+            data=data,
+            timeout=timeout,
+            headers=headers,
+            **kwargs
+        )
@@ -0,0 +1,66 @@
+import concurrent.futures
+from collections import deque
+from typing import Callable
+
+from config import WC_DRIVER_BATCH_SIZE, WC_DRIVER_BATCH_WORKERS
+
+
+class BatchStream:
+    """
+    Groups items into WC_DRIVER_BATCH_SIZE chunks per action and sends each chunk as soon as it is full.
+    When 2 * WC_DRIVER_BATCH_WORKERS chunks are waiting for the store, add blocks,
+    so a generator feeding it is not advanced faster than the store takes the items
+    """
+
+    def __init__(self, send_batch: Callable[[str, list], list]) -> None:
+        """
+        :param send_batch: sends one chunk, returns the failed items
+        """
+        self.send_batch = send_batch
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=WC_DRIVER_BATCH_WORKERS)
+        self.futures = deque()
+        self.pending = {}
+        self.counts = {'create': 0, 'update': 0, 'delete': 0}
+        self.failed = []
+
+    def _send(self, action: str, items: list) -> None:
+        self.counts[action] += len(items)
+        self.futures.append(self.executor.submit(self.send_batch, action, items))
+        while len(self.futures) > WC_DRIVER_BATCH_WORKERS * 2:
+            self.failed.extend(self.futures.popleft().result())
+
+    def add(self, action: str, item) -> None:
+        items = self.pending.setdefault(action, [])
+        items.append(item)
+        if len(items) >= WC_DRIVER_BATCH_SIZE:
+            self._send(action, items)
+            self.pending[action] = []
+
+    def flush(self) -> None:
+        """
+        Send the partial chunks
+        """
+        for action, items in self.pending.items():
+            if items:
+                self._send(action, items)
+        self.pending = {}
+
+    def close(self) -> list:
+        """
+        Send the rest and wait for the store
+        :return: list of failed items
+        """
+        self.flush()
+        while self.futures:
+            self.failed.extend(self.futures.popleft().result())
+        self.executor.shutdown()
+        return self.failed
+
+    def __enter__(self) -> 'BatchStream':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(cancel_futures=True)
@@ -1,9 +1,26 @@
-from woocommerce import API
+import html
 import json
+import requests
 import logging
+import concurrent.futures
+from collections import deque
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
 from tqdm import tqdm
 
-from config import WoocommerceConfig
+from simply_parser.limiter import AdaptiveLimiter, AdaptiveHTTPAdapter
+from simply_parser.metrics import metrics
+from simply_parser.product import Product, Stock
+from simply_parser.utils import get_socket_options, log_pool_stats
+from upload_wc.api import SessionAPI
+from upload_wc.batching import BatchStream
+from upload_wc.images import ImageCache, MediaUploader
+from upload_wc.utils import get_content_hash, get_category_slug, get_store_key
+from config import WoocommerceConfig, WC_DRIVER_BATCH_SIZE, WC_DRIVER_BATCH_WORKERS, \
+    WC_DRIVER_PER_PAGE, WC_DRIVER_HASH_META_KEY, WC_DRIVER_FETCH_WORKERS, WC_DRIVER_CACHE_PATH, \
+    WC_DRIVER_CATEGORY_CACHE, WC_DRIVER_IMAGE_CACHE, WC_DRIVER_LIMITER_INITIAL, WC_DRIVER_LIMITER_MAX, \
+    WC_DRIVER_POOL_MAXSIZE, WC_DRIVER_TIMEOUT, WC_DRIVER_BATCH_TIMEOUT
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
@@ -12,97 +29,471 @@ logging.basicConfig(
 
 class WooCommerceDriver:
 
-    def __init__(self, config: WoocommerceConfig) -> None:
-        self.categories = []
+    def __init__(self, config: WoocommerceConfig, cache_path: Path = WC_DRIVER_CACHE_PATH) -> None:
+        """
+        :param cache_path: directory of the category and image caches
+        """
+        # category slug -> category id
+        self.categories = {}
+        self.category_cache_path = cache_path / f'categories_{get_store_key(config.wc_site)}.json'
+        self.images = ImageCache(cache_path / f'images_{get_store_key(config.wc_site)}.json',
+                                 enabled=WC_DRIVER_IMAGE_CACHE)
+        self.uploader = None
+        if config.wp_user and config.wp_password:
+            self.uploader = MediaUploader(config.wc_site, config.wp_user, config.wp_password, self.images)
 
         self.product_data = []
 
-        self.api = API(
+        # one pool of kept-alive connections for all calls, batch writes are retried only when throttled
+        self.limiter = AdaptiveLimiter(WC_DRIVER_LIMITER_INITIAL, WC_DRIVER_LIMITER_MAX, name='wc')
+        self.session = requests.Session()
+        adapter = AdaptiveHTTPAdapter(limiter=self.limiter, unsafe_methods=('POST', 'PUT', 'DELETE'),
+                                      socket_options=get_socket_options(), pool_maxsize=WC_DRIVER_POOL_MAXSIZE,
+                                      max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.hooks['response'].append(metrics.response_hook('wc'))
+        # the keys are checked on the first answer of the store instead of a request of their own
+        self.authorized = None
+        self.session.hooks['response'].append(self._check_auth)
+
+        self.api = SessionAPI(
             url=config.wc_site,
             consumer_key=config.wc_key,
             consumer_secret=config.wc_secret,
-            timeout=60
+            session=self.session,
+            timeout=WC_DRIVER_TIMEOUT
         )
-        if self.api.get('products/categories').status_code == 200:
+
+    def _check_auth(self, response: requests.Response, *args, **kwargs) -> None:
+        if self.authorized is not None:
+            return
+        self.authorized = response.status_code not in (401, 403)
+        if self.authorized:
             logging.info('authorization successfully')
         else:
             logging.error('authorization error')
 
-    def get_all_category(self) -> None:
-        response = json.loads(self.api.get('products/categories').text)
-        for category in response:
-            self.categories.append({
-                'id': category['id'],
-                'name': category['name']
-            })
+    def _iter_pages(self, endpoint: str, params: dict = None) -> Iterator[dict]:
+        """
+        Yield every item of a paginated endpoint.
+        The first page gives X-WP-TotalPages, the rest are fetched concurrently
+        with at most 2 * WC_DRIVER_FETCH_WORKERS pages held in memory.
+        A page answered with an error raises requests.HTTPError
+        :param endpoint: endpoint of the list
+        :param params: extra query params
+        """
+        params = dict(params or {}, per_page=WC_DRIVER_PER_PAGE)
+        response = self.api.get(endpoint, params=dict(params, page=1))
+        response.raise_for_status()
+        total_pages = int(response.headers.get('X-WP-TotalPages', 1))
+        yield from response.json()
+
+        pages = iter(range(2, total_pages + 1))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=WC_DRIVER_FETCH_WORKERS) as executor:
+            def submit(page: int) -> concurrent.futures.Future:
+                return executor.submit(self.api.get, endpoint, params=dict(params, page=page))
+
+            futures = deque(submit(page) for page in islice(pages, WC_DRIVER_FETCH_WORKERS * 2))
+            while futures:
+                response = futures.popleft().result()
+                response.raise_for_status()
+                next_page = next(pages, None)
+                if next_page is not None:
+                    futures.append(submit(next_page))
+                yield from response.json()
+
+    def get_all_category(self, refresh: bool = False) -> None:
+        """
+        Build the category index, from the on-disk cache of this store when there is one
+        :param refresh: always read the categories from the store
+        """
+        if WC_DRIVER_CATEGORY_CACHE and not refresh and self.category_cache_path.exists():
+            self.categories = json.loads(self.category_cache_path.read_text(encoding='utf-8'))
+            self._check_category_cache()
+            return
+
+        self.categories = {}
+        for category in self._iter_pages('products/categories', {'_fields': 'id,name'}):
+            self.categories[get_category_slug(category['name'])] = category['id']
+        self._save_category_cache()
+
+    def _check_category_cache(self) -> None:
+        """
+        Drop cached categories deleted from the store, e.g. in wp-admin, with one listing of ids.
+        The store skips a category id it does not have, and the id is part of the content hash,
+        so a stale id would never be corrected
+        """
+        store_ids = {category['id'] for category in self._iter_pages('products/categories', {'_fields': 'id'})}
+        stale = [slug for slug, category_id in self.categories.items() if category_id not in store_ids]
+        if stale:
+            logging.info(f'{len(stale)} cached categories are no longer in the store')
+            for slug in stale:
+                del self.categories[slug]
+            self._save_category_cache()
+
+    def _forget_category(self, category_id: int) -> None:
+        for slug in [slug for slug, cached_id in self.categories.items() if cached_id == category_id]:
+            del self.categories[slug]
+
+    def _save_category_cache(self) -> None:
+        if WC_DRIVER_CATEGORY_CACHE:
+            self.category_cache_path.parent.mkdir(parents=True, exist_ok=True)
+            self.category_cache_path.write_text(json.dumps(self.categories), encoding='utf-8')
+
+    def get_category(self, name_category: str) -> int | None:
+        return self.categories.get(get_category_slug(name_category))
 
-    def get_category(self, name_category: str) -> int:
-        for category in self.categories:
-            if name_category == category['name']:
-                return category['id']
+    def get_all_products(self) -> dict:
+        """
+        Current store state
+        :return: dict of sku -> {'id': product id, 'hash': content hash | None, 'name': product name},
+            products without sku are keyed by id:<product id>
+        """
+        products = {}
+        for product in self._iter_pages('products', {'_fields': 'id,sku,name,meta_data'}):
+            content_hash = next((meta['value'] for meta in product['meta_data']
+                                 if meta['key'] == WC_DRIVER_HASH_META_KEY), None)
+            sku = product['sku'] or f'id:{product["id"]}'
+            products[sku] = {'id': product['id'], 'hash': content_hash, 'name': product['name']}
+        return products
 
     def delete_all_products(self):
-        product_data = json.loads(self.api.get('products').text)
+        product_ids = [product['id'] for product in self._iter_pages('products', {'_fields': 'id'})]
 
         logging.info('delete all products')
-        for product in tqdm(product_data):
-            self.api.delete(f'products/{product["id"]}')
+        self.batch_products(delete=product_ids)
+
+    def _batch_categories(self, action: str, items: list) -> None:
+        """
+        Send products/categories/batch and keep the category index in line with the result
+        :param action: create | delete
+        :param items: category payloads (ids for delete)
+        """
+        for i in range(0, len(items), WC_DRIVER_BATCH_SIZE):
+            chunk = items[i:i + WC_DRIVER_BATCH_SIZE]
+            try:
+                response = self.api.post('products/categories/batch', {action: chunk},
+                                         timeout=WC_DRIVER_BATCH_TIMEOUT)
+            except requests.RequestException as error:
+                logging.error(f'batch {action} of categories failed: {error!r}')
+                continue
+            if response.status_code != 200:
+                logging.error(f'batch {action} of categories failed: {response.text[:200]}')
+                continue
+
+            for item, result in zip(chunk, response.json().get(action, [])):
+                error = result.get('error')
+                if action == 'create' and error and error.get('code') == 'term_exists':
+                    # the store already has it, the cached index was out of date
+                    self.categories[get_category_slug(item['name'])] = error['data']['resource_id']
+                elif action == 'delete' and error and error.get('code') == 'woocommerce_rest_term_invalid':
+                    # already deleted from the store
+                    self._forget_category(item)
+                elif error:
+                    logging.error(f'batch {action} failed for category {item}: {error.get("message")}')
+                elif action == 'create':
+                    self.categories[get_category_slug(result['name'])] = result['id']
+                else:
+                    self.categories.pop(get_category_slug(result['name']), None)
 
     def create_category(self, categories_list: list) -> None:
-        self.get_all_category()
+        """
+        Make the store categories match categories_list
+        """
+        with metrics.timer('wc_categories'):
+            self.get_all_category()
+            wanted = {get_category_slug(name): name for name in categories_list}
+
+            logging.info('deleted unnecessary categories')
+            self._batch_categories('delete', [category_id for slug, category_id in self.categories.items()
+                                              if slug not in wanted])
+
+            logging.info('create categories')
+            self._batch_categories('create', [{'name': name, 'description': 'category description'}
+                                              for slug, name in wanted.items() if slug not in self.categories])
+
+            self._save_category_cache()
+
+    def _get_product_data(self, product: Product) -> dict:
+        return {
+            'sku': product.article,
+            'name': product.name,
+            'description': product.description,
+            'regular_price': str(product.price),
+            'on_sale': product.is_available,
+            'manage_stock': True,
+            'stock_quantity': product.in_stock,
+            'meta_data': [{
+                'key': 'maximum_allowed_quantity',
+                'value': str(product.in_stock)
+            }],
+            'categories': [
+                {
+                    'id': self.get_category(category)
+                }
+                for category in sorted(product.categories)
+            ],
+            'images': [
+                {
+                    'src': product.image
+                }
+            ],
+            'attributes': [
+                {
+                    'name': name,
+                    'visible': True,
+                    'variation': True,
+                    'options': [
+                        value
+                    ]
+                }
+                for name, value in product.features
+            ]
+        }
+
+    def _resolve_images(self, product_data: dict) -> dict:
+        """
+        Reference images already in the media library by id instead of src
+        """
+        if 'images' not in product_data:
+            return product_data
+        images = []
+        for image in product_data['images']:
+            media_id = self.images.get(image.get('src'))
+            images.append({'id': media_id} if media_id else image)
+        return dict(product_data, images=images)
+
+    def _send_batch(self, action: str, items: list, retry: bool = True) -> list:
+        """
+        Send one chunk of products/batch.
+        Images are sent by media id when the image cache has them, ids the store rejects
+        are dropped from the cache and the products are sent again by src
+        :param action: create | update | delete
+        :param items: product payloads (ids for delete)
+        :param retry: send again the products rejected for an invalid image id
+        :return: list of failed items
+        """
+        payload = items
+        if action != 'delete':
+            if self.uploader:
+                self.uploader.upload_many(image['src'] for item in items for image in item.get('images', []))
+            payload = [self._resolve_images(item) for item in items]
+
+        metrics.count('wc_items', len(items), action=action)
+        try:
+            with metrics.timer('wc_batch', f'products/batch {action}'):
+                response = self.api.post('products/batch', {action: payload}, timeout=WC_DRIVER_BATCH_TIMEOUT)
+        except requests.RequestException as error:
+            # writes are not retried, the store may have applied a part of the chunk
+            error = {'code': type(error).__name__, 'message': str(error)[:200]}
+            return [{'action': action, 'item': item, 'error': error} for item in items]
+        if response.status_code != 200:
+            error = {'code': response.status_code, 'message': response.text[:200]}
+            return [{'action': action, 'item': item, 'error': error} for item in items]
 
-        logging.info('deleted unnecessary categories')
-        for category in tqdm(self.categories):
-            if category['name'] in categories_list:
-                categories_list.remove(category['name'])
+        failed = []
+        invalid_image = []
+        for item, sent, result in zip(items, payload, response.json().get(action, [])):
+            error = result.get('error')
+            if error is None:
+                if action != 'delete':
+                    self._remember_images(sent, result)
+            elif retry and error.get('code') == 'woocommerce_product_invalid_image_id':
+                for image in sent.get('images', []):
+                    if 'id' in image:
+                        self.images.discard(image['id'])
+                invalid_image.append(item)
             else:
-                self.api.delete(f'products/categories/{category["id"]}')
+                failed.append({'action': action, 'item': item, 'error': error})
 
-        logging.info('create categories')
-        for category in tqdm(categories_list):
-            category_data = {
-                "name": category,
-                "description": "category description"
-            }
-            self.api.post('products/categories', category_data, params={'force': True})
+        if invalid_image:
+            failed += self._send_batch(action, invalid_image, retry=False)
+        return failed
 
-        self.get_all_category()
+    def _remember_images(self, sent: dict, result: dict) -> None:
+        """
+        Cache the media ids the store gave to images sent by src
+        """
+        for image, stored in zip(sent.get('images', []), result.get('images', [])):
+            if 'src' in image and stored.get('id'):
+                self.images.add(image['src'], stored['id'])
+
+    def batch_products(self, create: list = None, update: list = None, delete: list = None) -> list:
+        """
+        Create, update and delete products through products/batch.
+        Chunks are sized to WC_DRIVER_BATCH_SIZE and sent concurrently
+        :return: list of failed items with the error reported by the store
+        """
+        chunks = []
+        for action, items in (('create', create), ('update', update), ('delete', delete)):
+            items = items or []
+            chunks += [(action, items[i:i + WC_DRIVER_BATCH_SIZE])
+                       for i in range(0, len(items), WC_DRIVER_BATCH_SIZE)]
+
+        failed = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=WC_DRIVER_BATCH_WORKERS) as executor:
+            futures = [executor.submit(self._send_batch, action, chunk) for action, chunk in chunks]
+            for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
+                failed += future.result()
+
+        self.images.save()
+        self._log_failed(failed)
+        return failed
+
+    @staticmethod
+    def _log_failed(failed: list) -> None:
+        for fail in failed:
+            item = fail['item']
+            name = item if fail['action'] == 'delete' else item.get('sku') or item.get('name')
+            logging.error(f'batch {fail["action"]} failed for {name}: {fail["error"].get("message")}')
 
     def add_products(self, products_list: list) -> None:
         self.delete_all_products()
 
         logging.info('create new products')
-        for product in tqdm(products_list):
-            product_data = {
-                'name': product['name'],
-                'description': product['description'],
-                'regular_price': str(product['price']),
-                'on_sale': product['is_available'],
-                'stock_quantity': product['in_stock'],
-                'meta_data': [{
-                    'key': 'maximum_allowed_quantity',
-                    'value': str(product['in_stock'])
-                }],
-                'categories': [
-                    {
-                        'id': self.get_category(product['category'])
-                    }
-                ],
-                'images': [
-                    {
-                        'src': product['image']
-                    }
-                ],
-                'attributes': [
-                    {
-                        'name': list(attribute.keys())[0],
-                        'visible': True,
-                        'variation': True,
-                        'options': [
-                            attribute[list(attribute.keys())[0]]
-                        ]
-                    }
-                    for attribute in product['features']
-                ]
-            }
-            self.api.post('products', product_data)
+        self.batch_products(create=[self._get_product_data(product) for product in products_list])
+
+    def sync_products(self, products: Iterable[Product], dry_run: bool = False,
+                      allow_delete: bool | Callable[[], bool] = True) -> list:
+        """
+        Send only the difference between the parsed catalog and the store.
+        Products are matched by sku, changes are detected by the content hash
+        kept in the product meta. Store products without sku, uploaded before the sku was sent,
+        are matched by name and updated with the sku. Products may come from a generator: full chunks
+        are sent while it is still running, and when 2 * WC_DRIVER_BATCH_WORKERS
+        chunks are waiting for the store the generator is not advanced
+        :param dry_run: only count what would be created, updated and deleted
+        :param allow_delete: delete store products missing from the catalog, a callable is asked
+            after the last product, so a crawl streamed into the sync can report its failures
+        :return: list of failed items with the error reported by the store
+        """
+        with metrics.timer('wc_store_state'):
+            store_products = self.get_all_products()
+        logging.info(f'Products in store: {len(store_products)}')
+
+        # name -> ids of the products without sku
+        legacy = {}
+        for sku, product in store_products.items():
+            if sku.startswith('id:'):
+                legacy.setdefault(html.unescape(product['name']), []).append(product['id'])
+        adopted = 0
+
+        seen = set()
+
+        with BatchStream((lambda action, items: []) if dry_run else self._send_batch) as stream:
+            for product in tqdm(products):
+                product_data = self._get_product_data(product)
+                sku = product_data['sku']
+                if not sku:
+                    logging.warning(f'Product without sku skipped: {product.url}')
+                    continue
+                if sku in seen:
+                    continue
+                seen.add(sku)
+
+                content_hash = get_content_hash(product_data)
+                product_data['meta_data'].append({'key': WC_DRIVER_HASH_META_KEY, 'value': content_hash})
+
+                current = store_products.get(sku)
+                if current is None and legacy.get(html.unescape(product_data['name'])):
+                    # the update gives the product its sku, the next sync matches it by sku
+                    current = {'id': legacy[html.unescape(product_data['name'])].pop(), 'hash': None}
+                    adopted += 1
+                if current is None:
+                    action = 'create'
+                elif current['hash'] != content_hash:
+                    action = 'update'
+                    product_data['id'] = current['id']
+                else:
+                    continue
+                stream.add(action, product_data)
+
+            # deletes go last, after every product of the catalog
+            stream.flush()
+            if adopted:
+                logging.info(f'{adopted} products without sku matched by name')
+            # products without sku that match no product of the catalog are not managed by sync
+            missing = [product['id'] for sku, product in store_products.items()
+                       if sku not in seen and not sku.startswith('id:')]
+            if callable(allow_delete):
+                allow_delete = allow_delete()
+            if allow_delete:
+                for product_id in missing:
+                    stream.add('delete', product_id)
+            elif missing:
+                logging.warning(f'The crawl was incomplete, {len(missing)} products missing from it are kept')
+
+        if dry_run:
+            logging.info(f'sync products, dry run: {stream.counts["create"]} to create, '
+                         f'{stream.counts["update"]} to update, {stream.counts["delete"]} to delete')
+            return stream.failed
+
+        self.images.save()
+        log_pool_stats(self.session)
+        logging.info(f'sync products: {stream.counts["create"]} created, {stream.counts["update"]} updated, '
+                     f'{stream.counts["delete"]} deleted, {len(stream.failed)} failed')
+        self._log_failed(stream.failed)
+        return stream.failed
+
+    def get_store_stock(self) -> dict:
+        """
+        Current price and stock of the store products
+        :return: dict of sku -> {'id': product id, 'regular_price': str, 'stock_quantity': int | None}
+        """
+        return {product['sku']: product
+                for product in self._iter_pages('products', {'_fields': 'id,sku,regular_price,stock_quantity'})
+                if product['sku']}
+
+    @staticmethod
+    def _get_stock_data(stock: Stock) -> dict:
+        """
+        The price and stock fields of _get_product_data. The content hash is cleared,
+        the store merges meta by key and would keep the hash of the old price and stock
+        """
+        return {
+            'regular_price': str(stock.price),
+            'on_sale': stock.is_available,
+            'manage_stock': True,
+            'stock_quantity': stock.in_stock,
+            'meta_data': [{
+                'key': 'maximum_allowed_quantity',
+                'value': str(stock.in_stock)
+            }, {
+                'key': WC_DRIVER_HASH_META_KEY,
+                'value': ''
+            }],
+        }
+
+    def refresh_stock(self, stocks: Iterable[Stock], dry_run: bool = False) -> list:
+        """
+        Update price and stock of the store products that changed, with partial updates.
+        Products that are not in the store are left to sync_products
+        :param dry_run: only count the products that would be updated
+        :return: list of failed items with the error reported by the store
+        """
+        with metrics.timer('wc_store_state'):
+            store_stock = self.get_store_stock()
+        logging.info(f'Products in store: {len(store_stock)}')
+
+        missing = 0
+        with BatchStream((lambda action, items: []) if dry_run else self._send_batch) as stream:
+            for stock in tqdm(stocks):
+                current = store_stock.get(stock.article)
+                if current is None:
+                    missing += 1
+                    continue
+                if current['regular_price'] == str(stock.price) \
+                        and str(current['stock_quantity']) == str(stock.in_stock):
+                    continue
+                stream.add('update', dict(self._get_stock_data(stock), id=current['id'], sku=stock.article))
+
+        if dry_run:
+            logging.info(f'refresh stock, dry run: {stream.counts["update"]} to update, {missing} not in store')
+            return stream.failed
+
+        log_pool_stats(self.session)
+        logging.info(f'refresh stock: {stream.counts["update"]} updated, {missing} not in store, '
+                     f'{len(stream.failed)} failed')
+        self._log_failed(stream.failed)
+        return stream.failed
@@ -0,0 +1,169 @@
+import concurrent.futures
+import hashlib
+import json
+import logging
+import mimetypes
+import threading
+from pathlib import Path
+from typing import Iterable
+from urllib.parse import urlsplit
+
+import requests
+
+from simply_parser.limiter import AdaptiveHTTPAdapter
+from simply_parser.metrics import metrics
+from simply_parser.utils import get_socket_options
+from config import WC_DRIVER_IMAGE_WORKERS, WC_DRIVER_BATCH_WORKERS
+
+
+class ImageCache:
+    """
+    Media ids of images already sideloaded by the store,
+    by source url and by sha1 of the image content.
+    Validators of a source (etag, last_modified, hash of the content) tell when it changed
+    """
+
+    def __init__(self, path: Path, enabled: bool = True) -> None:
+        self.path = path
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.by_src = {}
+        self.by_hash = {}
+        self.validators = {}
+        if enabled and path.exists():
+            data = json.loads(path.read_text(encoding='utf-8'))
+            self.by_src = data['src']
+            self.by_hash = data['hash']
+            self.validators = data.get('validators', {})
+
+    def get(self, src: str) -> int | None:
+        return self.by_src.get(src)
+
+    def get_by_hash(self, content_hash: str) -> int | None:
+        return self.by_hash.get(content_hash)
+
+    def get_validator(self, src: str) -> dict:
+        return self.validators.get(src, {})
+
+    def add(self, src: str, media_id: int, content_hash: str = None, validator: dict = None) -> None:
+        with self.lock:
+            self.by_src[src] = media_id
+            if content_hash:
+                self.by_hash[content_hash] = media_id
+            if validator is not None:
+                self.validators[src] = validator
+
+    def discard(self, media_id: int) -> list:
+        """
+        Forget a media id the store does not know any more
+        :return: source urls that pointed to it
+        """
+        with self.lock:
+            srcs = [src for src, cached_id in self.by_src.items() if cached_id == media_id]
+            for src in srcs:
+                del self.by_src[src]
+                self.validators.pop(src, None)
+            for content_hash in [key for key, cached_id in self.by_hash.items() if cached_id == media_id]:
+                del self.by_hash[content_hash]
+        return srcs
+
+    def save(self) -> None:
+        if not self.enabled:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            data = json.dumps({'src': self.by_src, 'hash': self.by_hash, 'validators': self.validators})
+        self.path.write_text(data, encoding='utf-8')
+
+
+class MediaUploader:
+    """
+    Upload images through the WordPress media endpoint ahead of the product batches.
+    Needs WordPress credentials (an application password), the WooCommerce keys
+    are not accepted by wp/v2/media. Cached images are revalidated once per run
+    and uploaded again when their content changed at the same url
+    """
+
+    def __init__(self, site: str, user: str, password: str, cache: ImageCache) -> None:
+        self.url = f'{site.rstrip("/")}/wp-json/wp/v2/media'
+        self.cache = cache
+        self.auth = (user, password)
+        self.session = requests.Session()
+        # upload_many runs in every batch worker
+        adapter = AdaptiveHTTPAdapter(socket_options=get_socket_options(),
+                                      pool_maxsize=WC_DRIVER_IMAGE_WORKERS * WC_DRIVER_BATCH_WORKERS)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # sources checked against their validators in this run
+        self.revalidated = set()
+        self.revalidated_lock = threading.Lock()
+
+    def upload(self, src: str) -> int | None:
+        """
+        Sideload one image, an image with known content is not uploaded again
+        :return: media id | None on failure
+        """
+        try:
+            with metrics.timer('image_upload', src):
+                return self._upload(src)
+        except requests.RequestException as e:
+            logging.error(f'image upload failed {src}: {e}')
+            return None
+
+    def _upload(self, src: str) -> int | None:
+        cached_id = self.cache.get(src)
+        validator = self.cache.get_validator(src) if cached_id is not None else {}
+        headers = {}
+        if validator.get('etag'):
+            headers['If-None-Match'] = validator['etag']
+        if validator.get('last_modified'):
+            headers['If-Modified-Since'] = validator['last_modified']
+
+        response = self.session.get(src, headers=headers, timeout=60)
+        if response.status_code == 304:
+            return cached_id
+        if response.status_code != 200:
+            logging.error(f'image download failed {src}: {response.status_code}')
+            return None
+
+        content_hash = hashlib.sha1(response.content).hexdigest()
+        cached_hash = validator.get('hash')
+        validator = {
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified'),
+            'hash': content_hash,
+        }
+        # images sideloaded by the store have no hash yet, the first check records it
+        if cached_id is not None and cached_hash in (None, content_hash):
+            self.cache.add(src, cached_id, content_hash, validator)
+            return cached_id
+        media_id = self.cache.get_by_hash(content_hash)
+        if media_id is None:
+            filename = Path(urlsplit(src).path).name or f'{content_hash}.jpg'
+            content_type = response.headers.get('content-type') or mimetypes.guess_type(filename)[0]
+            upload = self.session.post(self.url, data=response.content, auth=self.auth, timeout=60, headers={
+                'Content-Disposition': f'attachment; filename="{filename}"',
+                'Content-Type': content_type or 'application/octet-stream',
+            })
+            if upload.status_code != 201:
+                logging.error(f'image upload failed {src}: {upload.text[:200]}')
+                return None
+            media_id = upload.json()['id']
+
+        if cached_id is not None:
+            logging.info(f'image changed {src}, uploaded again')
+        self.cache.add(src, media_id, content_hash, validator)
+        return media_id
+
+    def upload_many(self, srcs: Iterable[str]) -> None:
+        """
+        Upload in parallel the images that are not in the cache yet
+        and revalidate the cached ones not checked in this run
+        """
+        with self.revalidated_lock:
+            srcs = {src for src in srcs if src and src not in self.revalidated}
+            self.revalidated |= srcs
+        if not srcs:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=WC_DRIVER_IMAGE_WORKERS) as executor:
+            list(executor.map(self.upload, srcs))
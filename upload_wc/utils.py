@@ -0,0 +1,26 @@
+import hashlib
+import html
+import json
+import re
+
+
+def get_content_hash(product_data: dict) -> str:
+    """
+    Stable hash of a product payload, used to detect changed products
+    """
+    payload = json.dumps(product_data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def get_category_slug(name: str) -> str:
+    """
+    Normalized category name, the same for a catalog slug and the name kept by the store
+    """
+    return re.sub(r'[^a-z0-9]+', '-', html.unescape(name).lower()).strip('-')
+
+
+def get_store_key(url: str) -> str:
+    """
+    Short key of a store url for cache file names
+    """
+    return hashlib.sha1(url.rstrip('/').encode('utf-8')).hexdigest()[:12]